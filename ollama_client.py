@@ -1,167 +1,104 @@
-from gc import enable
+import sys
+
+# Run the CLI when executed with plain python, `streamlit run` starts the UI below
+if __name__ == '__main__' and 'streamlit' not in sys.modules:
+    from ollama_core.cli import main
+    sys.exit(main())
 
 import streamlit as st
-import sqlite3
-import requests
-import json
-import time
 from datetime import datetime
-import pandas as pd
 import io
-
-# Ollama client class for managing API calls and model interactions
-class OllamaAPIClient:
-    def __init__(self, base_url='http://localhost:11434'):
-        self.base_url = base_url
-
-    def get_available_models(self):
-        try:
-            url = f'{self.base_url}/api/tags'
-            response = requests.get(url)
-            if response.status_code == 200:
-                models_data = response.json().get('models', [])
-                models = [model['name'] for model in models_data]
-                print(models)
-                return models
-            else:
-                st.error(f"Error retrieving model list: {response.status_code}")
-                return []
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error retrieving model list: {e}")
-            return []
-
-    def generate_response(self, model_name, user_input):
-        url = f'{self.base_url}/api/generate'
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            'model': model_name,
-            'prompt': user_input,
-            'stream': False
-        }
-        start_time = time.time()
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        end_time = time.time()
-        response_time = end_time - start_time  # Calculate response time
-        if response.status_code == 200:
-            return response.json().get('response', ''), response_time
-        else:
-            error_message = response.json().get('error', 'Unknown error.')
-            st.error(f"Error communicating with the model: {error_message}")
-            return '', response_time
-
-# Database manager class for managing database operations
-class DatabaseManager:
-    def __init__(self, db_name='chat_history.db'):
-        self.db_name = db_name
-        self.initialize_database()
-
-    def initialize_database(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        # Create the session table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS session (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # Create the conversations table with response_time column
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                model_name TEXT,
-                user_input TEXT,
-                bot_response TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES session(id)
-            )
-        ''')
-        # Check if response_time column exists, and add it if not
-        c.execute("PRAGMA table_info(conversations)")
-        columns = [column[1] for column in c.fetchall()]
-        if 'response_time' not in columns:
-            c.execute('ALTER TABLE conversations ADD COLUMN response_time REAL')
-        conn.commit()
-        conn.close()
-
-    def save_conversation(self, session_id, model_name, user_input, bot_response, response_time):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO conversations (session_id, model_name, user_input, bot_response, response_time)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session_id, model_name, user_input, bot_response, response_time))
-        conn.commit()
-        conn.close()
-
-    def create_new_session(self, name):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        try:
-            c.execute('''
-                INSERT INTO session (name)
-                VALUES (?)
-            ''', (name,))
-            conn.commit()
-            session_id = c.lastrowid
-        except sqlite3.IntegrityError:
-            st.warning("Session name already exists. Please choose a different name.")
-            session_id = None
-        conn.close()
-        return session_id
-
-    def load_sessions(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute('SELECT id, name FROM session ORDER BY timestamp DESC')
-        results = c.fetchall()
-        conn.close()
-        return results
-
-    def load_conversation_history(self, session_id):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute('''
-            SELECT user_input, bot_response, model_name, timestamp, response_time
-            FROM conversations
-            WHERE session_id = ?
-            ORDER BY timestamp DESC
-        ''', (session_id,))
-        results = c.fetchall()
-        conn.close()
-        return results
-
-    def delete_session(self, session_id):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute('DELETE FROM conversations WHERE session_id = ?', (session_id,))
-        c.execute('DELETE FROM session WHERE id = ?', (session_id,))
-        conn.commit()
-        conn.close()
-
-# Helper function to prepare comparison data and generate CSV
+import os
+import csv
+import tempfile
+
+from ollama_core import (
+    ChatContextManager, DatabaseMaintenance, DatabaseManager, EmbeddingIndex, JobQueue, OllamaAPIClient,
+    ResponseCache, format_seconds
+)
+from ollama_core.jobs import ACTIVE_STATUSES
+from ollama_core.telemetry import configure_from_env
+from ollama_core.export import EXPORT_MIME_TYPES, export_conversations
+
+# Helper function to prepare comparison rows and generate CSV
 def prepare_comparison_data(prompt, responses):
-    data = {
-        "Model": [],
-        "Response": [],
-        "Response Time (seconds)": []
-    }
-    for model_name, bot_response, response_time in responses:
-        data["Model"].append(model_name)
-        data["Response"].append(bot_response)
-        data["Response Time (seconds)"].append(f"{response_time:.2f}")
-    return pd.DataFrame(data)
-
-def create_csv_report(df):
+    rows = []
+    for model_name, bot_response, response_time, ttft, metrics in responses:
+        # Cold start load time is reported apart from the time spent generating
+        load_duration = metrics.get('load_duration') or 0.0
+        rows.append({
+            "Model": model_name,
+            "Response": bot_response,
+            "Response Time (seconds)": f"{response_time:.2f}",
+            "Time to First Token (seconds)": f"{ttft:.2f}" if ttft is not None else "",
+            "Model Load (seconds)": f"{load_duration:.2f}",
+            "Inference Time (seconds)": f"{max(response_time - load_duration, 0.0):.2f}"
+        })
+    return rows
+
+def create_csv_report(rows):
     csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
+    if rows:
+        writer = csv.DictWriter(csv_buffer, fieldnames=list(rows[0]), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
     return csv_buffer.getvalue()
 
-# Instantiate the classes
-ollama_client = OllamaAPIClient()
-db_manager = DatabaseManager()
+# Instantiate the classes once per server process so pooled HTTP and database connections survive reruns
+@st.cache_resource
+def get_db_manager():
+    return DatabaseManager()
+
+@st.cache_resource
+def get_ollama_client():
+    # /metrics on $OLLAMA_METRICS_PORT and spans to $OLLAMA_TRACE_FILE, once per server process
+    configure_from_env()
+    # OLLAMA_HOSTS may list several comma separated Ollama hosts to balance requests across
+    client = OllamaAPIClient(base_url=os.environ.get('OLLAMA_HOSTS', 'http://localhost:11434'), on_error=st.error)
+    # Fetch the model list in the background while the database is opened
+    client.registry.prefetch()
+    client.cache = ResponseCache(db_manager=get_db_manager())
+    return client
+
+@st.cache_resource
+def get_chat_context():
+    return ChatContextManager(get_db_manager())
+
+# Embeddings of saved prompts for semantic search, computed by a background thread after each save
+@st.cache_resource
+def get_embedding_index():
+    return EmbeddingIndex(get_db_manager(), get_ollama_client())
+
+# Generations run as jobs queued in the database, so they finish and get saved even when the script
+# reruns or the browser disconnects. Set OLLAMA_JOB_WORKERS for more jobs at once, or run
+# `python -m ollama_core worker` in other processes to share the queue.
+@st.cache_resource
+def get_job_queue():
+    embedding_index = get_embedding_index()
+
+    # Called from a worker thread once a job's turns are saved. The chat context reads new turns from the
+    # database itself, so jobs finished by other processes reach it too.
+    def on_done(job_id, rows):
+        embedding_index.notify()
+
+    job_queue = JobQueue(get_db_manager(), get_ollama_client(), on_done=on_done)
+    job_queue.start()
+    return job_queue
+
+# Retention, orphan cleanup and incremental vacuum in a background thread. Sessions are only archived when
+# OLLAMA_RETENTION_DAYS or OLLAMA_MAX_DB_MB is set, see `python -m ollama_core maintain --help`.
+@st.cache_resource
+def get_maintenance():
+    maintenance = DatabaseMaintenance(get_db_manager())
+    maintenance.start()
+    return maintenance
+
+db_manager = get_db_manager()
+ollama_client = get_ollama_client()
+chat_context = get_chat_context()
+embedding_index = get_embedding_index()
+job_queue = get_job_queue()
+get_maintenance()
 
 # Set page layout to wide to utilize empty margins
 st.set_page_config(page_title='ollama-client', layout="wide")
@@ -172,11 +109,54 @@ st.title('GoOllama')
 # Sidebar for model selection and session list
 st.sidebar.title('Select Model')
 models = ollama_client.get_available_models()
+KEEP_ALIVE_CHOICES = {'5 minutes': '5m', '30 minutes': '30m', '1 hour': '1h', 'Until unloaded': -1}
+COLD_START_THRESHOLD = 0.5  # Seconds of model load time after which a response counts as a cold start
+
+# Load newly selected models in the background so the first message doesn't pay for it
+def warm_selected_models():
+    ollama_client.residency.warm_async(st.session_state['selected_models'])
+
 if models:
-    selected_model = st.sidebar.multiselect('Model', models, default=[models[0]])
+    selected_model = st.sidebar.multiselect(
+        'Model', models, default=[models[0]], key='selected_models', on_change=warm_selected_models
+    )
+    keep_alive_label = st.sidebar.selectbox('Keep selected models loaded for', list(KEEP_ALIVE_CHOICES))
+    for model_name in selected_model:
+        ollama_client.residency.set_keep_alive(model_name, KEEP_ALIVE_CHOICES[keep_alive_label])
+    loaded_models = ollama_client.residency.loaded_models()
+    st.sidebar.caption(
+        'Loaded: ' + (', '.join(name for name in selected_model if name in loaded_models) or 'none of the selected models')
+    )
 else:
     st.sidebar.warning("No models found. Please check your Ollama installation.")
 
+# Per-host health and latency when requests are balanced across several Ollama hosts
+if len(ollama_client.hosts.hosts) > 1:
+    with st.sidebar.expander('Ollama hosts'):
+        st.dataframe([
+            {
+                'Host': stats['host'],
+                'Status': 'up' if stats['healthy'] else 'down',
+                'In flight': stats['in_flight'],
+                'Requests': stats['requests'],
+                'Errors': stats['errors'],
+                'Latency': format_seconds(stats['latency']),
+                'Loaded': ', '.join(stats['loaded'])
+            }
+            for stats in ollama_client.hosts.stats()
+        ], hide_index=True)
+
+# Send earlier turns of the session to each model through /api/chat instead of a single prompt
+conversation_mode = st.sidebar.checkbox('Remember conversation', value=False)
+
+# Opt-in reuse of earlier answers to the exact same prompt from the same model version
+use_response_cache = st.sidebar.checkbox('Reuse cached responses', value=False)
+if use_response_cache:
+    cache_stats = ollama_client.cache.stats()
+    st.sidebar.caption(
+        f"Cache hits: {cache_stats['hits']} · misses: {cache_stats['misses']} · hit rate: {cache_stats['hit_rate']:.0%}"
+    )
+
 # Section for creating a new session
 st.sidebar.subheader('Create New Session')
 
@@ -199,6 +179,7 @@ def add_new_session():
             st.session_state['session_name'] = ""
             st.rerun()
         else:
+            st.warning("Session name already exists. Please choose a different name.")
             st.session_state['session_name'] = ""
 
 new_session_name = st.sidebar.text_input("Enter new session name:", key='session_name', on_change=add_new_session)
@@ -229,6 +210,7 @@ def confirm_delete():
     with col1:
         if st.button("Delete"):
             db_manager.delete_session(st.session_state['current_session_id'])
+            chat_context.invalidate(st.session_state['current_session_id'])
             st.session_state['session_list'] = db_manager.load_sessions()
             st.session_state['current_session_id'] = None
             st.session_state['current_session_name'] = None
@@ -249,84 +231,226 @@ if st.sidebar.button('Delete Selected Session'):
 current_session_id = st.session_state.get('current_session_id')
 current_session_name = st.session_state.get('current_session_name', 'Unnamed Session')
 
+# Export is only generated when the download is clicked, streamed from the database into a temporary file
+def build_export(export_format, session_id):
+    export_file = tempfile.TemporaryFile()
+    export_conversations(db_manager, export_file, export_format, session_id=session_id)
+    export_file.seek(0)
+    return export_file
+
+with st.sidebar.expander('Export History'):
+    export_scope = st.radio('Conversations', ['Current session', 'All sessions'], key='export_scope')
+    export_format = st.selectbox('Format', list(EXPORT_MIME_TYPES), key='export_format')
+    export_session_id = current_session_id if export_scope == 'Current session' else None
+    st.download_button(
+        'Download',
+        data=lambda: build_export(export_format, export_session_id),
+        file_name=f"{current_session_name if export_session_id else 'chat_history'}.{export_format}",
+        mime=EXPORT_MIME_TYPES[export_format],
+        disabled=export_scope == 'Current session' and current_session_id is None,
+        on_click='ignore'
+    )
+
 # Main chat interface
 st.subheader(f'Chat - {current_session_name}')
 
 user_input = st.text_area('You:', '', key='user_input', placeholder='Write your message')
 
-# Generate comparison report
-def generate_comparison_report():
-    if user_input and selected_model:
-        responses = []
-        for model_name in selected_model:
-            bot_response, response_time = ollama_client.generate_response(model_name, user_input)
-            responses.append((model_name, bot_response, response_time))
-
+# Generate comparison report from the responses of a finished job
+def generate_comparison_report(prompt, responses, key=None):
+    if prompt and responses:
         # Prepare data and create CSV
-        df = prepare_comparison_data(user_input, responses)
-        csv_file = create_csv_report(df)
+        rows = prepare_comparison_data(prompt, responses)
+        csv_file = create_csv_report(rows)
 
         # Streamlit button to download the report
         st.download_button(
             label="Download Comparison Report",
             data=csv_file,
             file_name="model_comparison_report.csv",
-            mime='text/csv'
+            mime='text/csv',
+            key=key
         )
 
-# Send message handler
+# Send message handler, queues the prompt for all selected models and returns right away
 def send_message():
     if user_input and current_session_id:
-        responses = []
         prompt = st.session_state.get("user_input")
-        for model_name in selected_model:
-            bot_response, response_time = ollama_client.generate_response(model_name, prompt)
-            responses.append((model_name, bot_response, response_time))
-
-        # Save each response in the database
-        for model_name, bot_response, response_time in responses:
-            if bot_response:
-                if 'def ' in bot_response or 'class ' in bot_response:
-                    bot_response = f"```python\n{bot_response}\n```"
-                db_manager.save_conversation(current_session_id, model_name, user_input, bot_response, response_time)
-
-        generate_comparison_report()
+        messages = None
+        if conversation_mode:
+            messages = {
+                model_name: chat_context.build(current_session_id, model_name, prompt)
+                for model_name in selected_model
+            }
+        job_id = job_queue.submit(
+            current_session_id, prompt, selected_model, use_cache=use_response_cache, messages=messages, wrap_code=True
+        )
+        st.session_state.setdefault('submitted_jobs', []).append(job_id)
     else:
         st.toast('Please write your message first.')
 
 st.button("Send", on_click=send_message)
 
-# Search bar for filtering conversation history
+JOB_POLL_INTERVAL = 0.5  # Seconds between refreshes of the partial output of running jobs
+JOB_PROMPT_CHARS = 80
+
+# Errors and comparison reports of the jobs sent from this browser, shown once when they finish
+for job_id in list(st.session_state.get('submitted_jobs', [])):
+    job = job_queue.get(job_id)
+    if job and job['status'] in ACTIVE_STATUSES:
+        continue
+    st.session_state['submitted_jobs'].remove(job_id)
+    if job is None:
+        continue  # Deleted with its session
+    for model_name, output in job['outputs'].items():
+        if output['error']:
+            st.error(f"Error communicating with {model_name}: {output['error']}")
+    generate_comparison_report(job['prompt'], [
+        (model_name, output['output'], output['response_time'] or 0.0, output['ttft'], output['metrics'])
+        for model_name, output in job['outputs'].items() if output['output']
+    ], key=f'comparison_report_{job_id}')
+
+# Live output of the session's queued and running jobs, from any browser. Only this fragment reruns
+# while polling, the whole app reruns once they are finished so the saved turns show in the history.
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_active_jobs(session_id):
+    active_jobs = job_queue.jobs(session_id, active=True)
+    if not active_jobs:
+        # The jobs may have been run by a worker in another process, which has no access to this index
+        embedding_index.notify()
+        st.rerun()
+    for job in reversed(active_jobs):
+        prompt = ' '.join(job['prompt'].split())
+        if len(prompt) > JOB_PROMPT_CHARS:
+            prompt = prompt[:JOB_PROMPT_CHARS] + '…'
+        state = 'Queued' if job['status'] == 'queued' else f"Generating {job['progress']}/{len(job['models'])}"
+        st.caption(f'{state} · {prompt}')
+        for model_name, output in job['outputs'].items():
+            st.markdown(f"**{model_name}**")
+            st.markdown(output['output'] or '…')
+
+if current_session_id and job_queue.jobs(current_session_id, active=True, limit=1):
+    show_active_jobs(current_session_id)
+
+# Search bar for ranked full-text search over the conversation history
 search_query = st.text_input('Search Conversation History', '')
-
-# Display the conversation history for the current session below the chat interface
-if current_session_id:
-    st.subheader(f'Conversation History - {current_session_name}')
-    full_conversation = db_manager.load_conversation_history(current_session_id)
-    filtered_conversation = [
-        conv for conv in full_conversation
-        if search_query.lower() in conv[0].lower() or search_query.lower() in conv[1].lower()
-    ]
-    for user_msg, bot_msg, model_name, msg_timestamp, response_time in filtered_conversation:
-        # Format the timestamp
-        formatted_time = datetime.strptime(msg_timestamp, '%Y-%m-%d %H:%M:%S').strftime('%b %d, %Y %H:%M')
-        formatted_response_time = f"{float(response_time):0.2f}" if response_time else ""
-
-        st.markdown(
-            f"<div style='text-align: left; background-color: #0056b3; color: white; padding: 10px; border-radius: 10px; margin: 5px 0; font-size: 18px'>"
-            f"<strong>You:</strong> {user_msg}"
-            f"<span style='float: right; font-size: 14px; color: #e6e6e6;'>{formatted_time}</span></div>",
-            unsafe_allow_html=True
-        )
+search_all_sessions = st.checkbox('Search all sessions')
+semantic_search = st.checkbox(
+    'Search by meaning', help=f'Find prompts similar in meaning using the {embedding_index.model_name} embedding model'
+)
+
+HISTORY_PAGE_SIZE = 50
+SEARCH_RESULT_LIMIT = 50
+SEMANTIC_SNIPPET_CHARS = 300
+
+# Semantic matches come back as whole messages, cut them to snippet length
+def shorten(text):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= SEMANTIC_SNIPPET_CHARS else text[:SEMANTIC_SNIPPET_CHARS] + '…'
+
+def load_more_history():
+    st.session_state['history_pages'] += 1
+
+# Pre-formatted HTML of one history row
+def format_history_row(row):
+    conv_id, user_msg, bot_msg, model_name, msg_timestamp, response_time, load_duration = row
+    formatted_time = datetime.strptime(msg_timestamp, '%Y-%m-%d %H:%M:%S').strftime('%b %d, %Y %H:%M')
+    formatted_response_time = f"{float(response_time):0.2f}" if response_time else ""
+    if load_duration and load_duration >= COLD_START_THRESHOLD:
+        formatted_response_time += f" (incl. {load_duration:0.2f} s model load)"
+    return (
+        f"<div style='text-align: left; background-color: #0056b3; color: white; padding: 10px; border-radius: 10px; margin: 5px 0; font-size: 18px'>"
+        f"<strong>You:</strong> {user_msg}"
+        f"<span style='float: right; font-size: 14px; color: #e6e6e6;'>{formatted_time}</span></div>"
+        f"<div style='text-align: left; background-color: #444; padding: 10px; border-radius: 10px; margin: 5px 0; font-size: 18px'>"
+        f"<strong style='color: #00b3b3;'>{model_name} (compared):</strong>"
+        f"<span style='float: right; font-size: 14px; color: yellow;'><strong>Response time:</strong> {formatted_response_time} seconds</span>"
+        f"<pre style='white-space: pre-wrap; word-wrap: break-word; font-size: 16px; background-color: #333; color: white !important; padding: 10px; border-radius: 5px;'>{bot_msg}</pre>"
+        f"</div>"
+    )
+
+# A page of history older than the `before` cursor, as (html, next_cursor). Rows never change once
+# written, so a page is formatted once and then served from the cache on every rerun. version is the
+# session's row count and only part of the cache key: rows imported into the past or archived by
+# another process change it, which rebuilds the pages.
+@st.cache_data(max_entries=200, show_spinner=False)
+def render_history_page(session_id, before, version):
+    rows, next_cursor = db_manager.load_conversation_page(session_id, HISTORY_PAGE_SIZE, before=before)
+    return ''.join(format_history_row(row) for row in rows), next_cursor
+
+# Rows added since the history view was opened, as (html, count). last_id and version are only part
+# of the cache key, so the block is rebuilt when a row arrives and the older pages stay cached.
+@st.cache_data(max_entries=50, show_spinner=False)
+def render_new_history(session_id, after, last_id, version):
+    rows, _ = db_manager.load_conversation_page(session_id, None, after=after)
+    return ''.join(format_history_row(row) for row in rows), len(rows)
+
+if search_query.strip():
+    st.subheader(f'Search Results - {"All Sessions" if search_all_sessions else current_session_name}')
+    session_lookup = dict(st.session_state['session_list'])
+    search_session_id = None if search_all_sessions else current_session_id
+    if semantic_search:
+        # Embeds history saved before the index existed in the background
+        embedding_index.notify()
+        results = [
+            (conv_id, session_id, model_name, msg_timestamp, shorten(user_input), shorten(bot_response), f' · {score:.2f}')
+            for conv_id, session_id, model_name, msg_timestamp, user_input, bot_response, score in embedding_index.search(
+                search_query, session_id=search_session_id, limit=SEARCH_RESULT_LIMIT
+            )
+        ]
+        if embedding_index.error:
+            st.warning(f'Search by meaning is unavailable: {embedding_index.error}')
+        pending = embedding_index.stats()['pending']
+        if pending:
+            st.caption(f'{pending} messages are still being indexed.')
+    else:
+        results = [
+            row + ('',) for row in db_manager.search(search_query, session_id=search_session_id, limit=SEARCH_RESULT_LIMIT)
+        ]
+    if not results:
+        st.info('No matching messages found.')
+    for conv_id, session_id, model_name, msg_timestamp, user_snippet, bot_snippet, score in results:
         st.markdown(
-            f"<div style='text-align: left; background-color: #444; padding: 10px; border-radius: 10px; margin: 5px 0; font-size: 18px'>"
-            f"<strong style='color: #00b3b3;'>{model_name} (compared):</strong>"
-            f"<span style='float: right; font-size: 14px; color: yellow;'><strong>Response time:</strong> {formatted_response_time} seconds</span>"
-            f"<pre style='white-space: pre-wrap; word-wrap: break-word; font-size: 16px; background-color: #333; color: white !important; padding: 10px; border-radius: 5px;'>{bot_msg}</pre>"
+            f"<div style='text-align: left; background-color: #444; padding: 10px; border-radius: 10px; margin: 5px 0; font-size: 16px'>"
+            f"<strong style='color: #00b3b3;'>{session_lookup.get(session_id, '')} · {model_name}{score}</strong>"
+            f"<span style='float: right; font-size: 14px; color: #e6e6e6;'>{msg_timestamp}</span>"
+            f"<div><strong>You:</strong> {user_snippet}</div>"
+            f"<div><strong>Bot:</strong> {bot_snippet}</div>"
             f"</div>",
             unsafe_allow_html=True
         )
 
+# Display the conversation history for the current session below the chat interface
+elif current_session_id:
+    st.subheader(f'Conversation History - {current_session_name}')
+    newest, _ = db_manager.load_conversation_page(current_session_id, 1)
+    last_id = newest[0][0] if newest else None
+    version = db_manager.count_conversations(current_session_id)
+    # Anchor the view at the newest row whenever the session changes. Pages older than the anchor
+    # never change, rows sent since then are shown in a separate block above them.
+    if st.session_state.get('history_key') != current_session_id:
+        st.session_state['history_key'] = current_session_id
+        st.session_state['history_pages'] = 1
+        st.session_state['history_anchor'] = (newest[0][4], newest[0][0]) if newest else None
+    anchor = st.session_state['history_anchor']
+    new_html, new_count = render_new_history(current_session_id, anchor, last_id, version)
+    if new_count >= HISTORY_PAGE_SIZE:
+        # Too many rows since the anchor, move it to the newest row
+        st.session_state['history_pages'] = 1
+        st.session_state['history_anchor'] = anchor = (newest[0][4], newest[0][0])
+        new_html = ''
+    if new_html:
+        st.markdown(new_html, unsafe_allow_html=True)
+    # The first page starts at the anchor row itself, `before` is exclusive so its id is bumped by one
+    cursor = (anchor[0], anchor[1] + 1) if anchor else None
+    for _ in range(st.session_state['history_pages'] if anchor else 0):
+        page_html, cursor = render_history_page(current_session_id, cursor, version)
+        st.markdown(page_html, unsafe_allow_html=True)
+        if cursor is None:
+            break
+    if cursor is not None:
+        st.button('Load older messages', on_click=load_more_history)
+
 # Custom CSS to remove the empty margins
 st.markdown("""
     <style>
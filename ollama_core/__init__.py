@@ -0,0 +1,45 @@
+# Shared core of the Streamlit and Gradio front-ends: Ollama client, chat history storage and maintenance,
+# response cache, batch runner, benchmark, metrics and tracing. Submodules are imported on first use, so
+# importing the package stays cheap and neither front-end pays for the parts it doesn't touch.
+import importlib
+
+_EXPORTS = {
+    'BatchRunner': 'batch',
+    'RESULT_WRITERS': 'batch',
+    'Benchmark': 'bench',
+    'ResponseCache': 'cache',
+    'main': 'cli',
+    'HostPool': 'client',
+    'ModelRegistry': 'client',
+    'ModelResidencyManager': 'client',
+    'OllamaAPIClient': 'client',
+    'OllamaHost': 'client',
+    'ResponseStream': 'client',
+    'ChatContextManager': 'context',
+    'estimate_tokens': 'context',
+    'EmbeddingIndex': 'embeddings',
+    'HistoryImporter': 'importer',
+    'JobQueue': 'jobs',
+    'LoadGenerator': 'loadtest',
+    'DatabaseMaintenance': 'maintenance',
+    'LATENCY_METRICS': 'metrics',
+    'extract_metrics': 'metrics',
+    'format_seconds': 'metrics',
+    'percentile': 'metrics',
+    'MockOllamaServer': 'mock',
+    'parse_distribution': 'mock',
+    'DatabaseManager': 'storage',
+    'REGISTRY': 'telemetry',
+    'add_span_exporter': 'telemetry',
+    'span': 'telemetry',
+    'start_http_server': 'telemetry',
+}
+
+__all__ = sorted(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
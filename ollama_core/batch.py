@@ -0,0 +1,276 @@
+import os
+import csv
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+# Incremental result writers for the batch runner, one record is written as soon as it completes
+# On resume, compact(path, done) first drops the records of pairs that aren't checkpointed (failed, or
+# not yet saved when the run stopped) and repeats, since those pairs are generated and written again
+class JsonlResultWriter:
+    def __init__(self, path, append=False):
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    @staticmethod
+    def compact(path, done):
+        if not os.path.exists(path):
+            return
+        seen = set()
+        with open(path, encoding='utf-8') as f, open(path + '.tmp', 'w', encoding='utf-8') as out:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line after a crash
+                pair = (record.get('id'), record.get('model'))
+                if pair in done and pair not in seen:
+                    seen.add(pair)
+                    out.write(line if line.endswith('\n') else line + '\n')
+        os.replace(path + '.tmp', path)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class CsvResultWriter:
+    def __init__(self, path, append=False):
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=BATCH_RESULT_FIELDS)
+        if write_header:
+            self.writer.writeheader()
+
+    @staticmethod
+    def compact(path, done):
+        if not os.path.exists(path):
+            return
+        seen = set()
+        with open(path, encoding='utf-8', newline='') as f, \
+                open(path + '.tmp', 'w', encoding='utf-8', newline='') as out:
+            writer = csv.DictWriter(out, fieldnames=BATCH_RESULT_FIELDS)
+            writer.writeheader()
+            for record in csv.DictReader(f):
+                pair = (record.get('id'), record.get('model'))
+                # A row cut short by a crash has missing fields filled with None
+                if pair in done and pair not in seen and None not in record.values():
+                    seen.add(pair)
+                    writer.writerow(record)
+        os.replace(path + '.tmp', path)
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ParquetResultWriter:
+    # Parquet files can't be appended to, so records are buffered into row groups and a resumed
+    # run writes a new part file next to the original one
+    def __init__(self, path, append=False, row_group_size=500):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Parquet output requires pyarrow, install it with `pip install pyarrow`.')
+        self.pa = pa
+        if append and os.path.exists(path):
+            stem, suffix = os.path.splitext(path)
+            part = 1
+            while os.path.exists(f'{stem}.part{part}{suffix}'):
+                part += 1
+            path = f'{stem}.part{part}{suffix}'
+        self.path = path
+        self.schema = pa.schema([
+            ('id', pa.string()), ('model', pa.string()), ('prompt', pa.string()), ('response', pa.string()),
+            ('response_time', pa.float64()), ('ttft', pa.float64()), ('prompt_eval_count', pa.int64()),
+            ('eval_count', pa.int64()), ('total_duration', pa.float64()), ('load_duration', pa.float64()),
+            ('prompt_eval_duration', pa.float64()), ('eval_duration', pa.float64()),
+            ('tokens_per_second', pa.float64()), ('error', pa.string()), ('timestamp', pa.string())
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.buffer = []
+
+    @staticmethod
+    def compact(path, done):
+        # Rewrites the original file and every part file written by earlier resumes
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Parquet output requires pyarrow, install it with `pip install pyarrow`.')
+        stem, suffix = os.path.splitext(path)
+        paths = [path]
+        while os.path.exists(f'{stem}.part{len(paths)}{suffix}'):
+            paths.append(f'{stem}.part{len(paths)}{suffix}')
+        seen = set()
+        for part_path in paths:
+            if not os.path.exists(part_path):
+                continue
+            table = pq.read_table(part_path)
+            keep = []
+            for index, pair in enumerate(zip(table.column('id').to_pylist(), table.column('model').to_pylist())):
+                if pair in done and pair not in seen:
+                    seen.add(pair)
+                    keep.append(index)
+            pq.write_table(table.take(keep), part_path + '.tmp')
+            os.replace(part_path + '.tmp', part_path)
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+BATCH_RESULT_FIELDS = [
+    'id', 'model', 'prompt', 'response', 'response_time', 'ttft', 'prompt_eval_count', 'eval_count',
+    'total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration', 'tokens_per_second',
+    'error', 'timestamp'
+]
+RESULT_WRITERS = {'jsonl': JsonlResultWriter, 'csv': CsvResultWriter, 'parquet': ParquetResultWriter}
+
+# Headless runner that sends every prompt of a JSONL file to several models with bounded concurrency,
+# writes results as they complete and checkpoints finished (prompt id, model) pairs for resuming
+class BatchRunner:
+    def __init__(self, client, models, concurrency=4, db_manager=None, session_name=None,
+                 options=None, use_cache=False, prompt_field='prompt', id_field='id', db_batch_size=50):
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.concurrency = concurrency
+        self.db_manager = db_manager
+        self.session_name = session_name
+        self.options = options
+        self.use_cache = use_cache
+        self.prompt_field = prompt_field
+        self.id_field = id_field
+        self.db_batch_size = db_batch_size
+
+    def read_prompts(self, path):
+        # Stream (prompt_id, prompt) pairs, falling back to the line number when there is no id field
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, str):
+                    yield str(line_number), item
+                else:
+                    yield str(item.get(self.id_field, line_number)), item[self.prompt_field]
+
+    @staticmethod
+    def load_checkpoint(path):
+        done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line after a crash
+                    done.add((entry['id'], entry['model']))
+        return done
+
+    def _run_one(self, prompt_id, prompt, model_name):
+        bot_response, response_time, ttft, error_message, metrics = self.client._post_generate(
+            model_name, prompt, options=self.options, use_cache=self.use_cache
+        )
+        return {
+            'id': prompt_id,
+            'model': model_name,
+            'prompt': prompt,
+            'response': bot_response,
+            'response_time': response_time,
+            'ttft': ttft,
+            'prompt_eval_count': metrics.get('prompt_eval_count'),
+            'eval_count': metrics.get('eval_count'),
+            'total_duration': metrics.get('total_duration'),
+            'load_duration': metrics.get('load_duration'),
+            'prompt_eval_duration': metrics.get('prompt_eval_duration'),
+            'eval_duration': metrics.get('eval_duration'),
+            'tokens_per_second': metrics.get('tokens_per_second'),
+            'error': error_message,
+            'timestamp': datetime.now().isoformat(timespec='seconds')
+        }
+
+    def run(self, prompts_path, output_path, output_format=None, checkpoint_path=None, progress=None):
+        output_format = output_format or os.path.splitext(output_path)[1].lstrip('.').lower()
+        if output_format not in RESULT_WRITERS:
+            raise ValueError(f'Unsupported output format: {output_format}')
+        checkpoint_path = checkpoint_path or f'{output_path}.checkpoint'
+        done = self.load_checkpoint(checkpoint_path)
+        if done:
+            RESULT_WRITERS[output_format].compact(output_path, done)
+        writer = RESULT_WRITERS[output_format](output_path, append=bool(done))
+        self.output_path = getattr(writer, 'path', output_path)
+        checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+        session_id = None
+        if self.db_manager:
+            session_id = self.db_manager.get_or_create_session(
+                self.session_name or f'batch {os.path.basename(prompts_path)}'
+            )
+        pending_rows = []
+        pending_checkpoint = []
+        completed = failed = skipped = 0
+
+        def flush():
+            # Pairs are only checkpointed once their rows are committed, so a crash in between reruns them
+            # instead of leaving them out of the history
+            if pending_rows:
+                self.db_manager.save_conversation_rows(pending_rows)
+                pending_rows.clear()
+            checkpoint.writelines(pending_checkpoint)
+            checkpoint.flush()
+            pending_checkpoint.clear()
+
+        def handle(record):
+            nonlocal completed, failed
+            writer.write(record)
+            if record['error']:
+                failed += 1
+            else:
+                # Only successful pairs are checkpointed so failures are retried on resume
+                pending_checkpoint.append(json.dumps({'id': record['id'], 'model': record['model']}) + '\n')
+                if session_id is not None:
+                    pending_rows.append((
+                        session_id, record['model'], record['prompt'], record['response'], record['response_time'],
+                        record['ttft'], record, self.options
+                    ))
+                if session_id is None or len(pending_rows) >= self.db_batch_size:
+                    flush()
+            completed += 1
+            if progress:
+                progress(completed, failed, record)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                in_flight = set()
+                for prompt_id, prompt in self.read_prompts(prompts_path):
+                    for model_name in self.models:
+                        if (prompt_id, model_name) in done:
+                            skipped += 1
+                            continue
+                        # Keep a bounded number of requests queued so huge prompt files stream through
+                        if len(in_flight) >= self.concurrency * 2:
+                            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                handle(future.result())
+                        in_flight.add(executor.submit(self._run_one, prompt_id, prompt, model_name))
+                for future in as_completed(in_flight):
+                    handle(future.result())
+        finally:
+            flush()
+            writer.close()
+            checkpoint.close()
+        return completed, failed, skipped
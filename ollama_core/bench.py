@@ -0,0 +1,60 @@
+from .metrics import percentile
+
+# Runs warmup and measured repetitions per model and summarizes Ollama's own timing fields
+class Benchmark:
+    METRICS = ('response_time', 'ttft', 'total_duration', 'load_duration', 'prompt_eval_duration',
+               'eval_duration', 'tokens_per_second')
+
+    def __init__(self, client, models, prompts, warmup=1, repetitions=5, stream=True, options=None):
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.prompts = prompts
+        self.warmup = warmup
+        self.repetitions = repetitions
+        self.stream = stream
+        self.options = options
+
+    def _sample(self, model_name, prompt):
+        if self.stream:
+            stream = self.client.stream_response(model_name, prompt, options=self.options)
+            for _ in stream:
+                pass
+            result = (stream.response_time, stream.ttft, stream.error, stream.metrics)
+        else:
+            _, response_time, ttft, error_message, metrics = self.client._post_generate(
+                model_name, prompt, options=self.options
+            )
+            result = (response_time, ttft, error_message, metrics)
+        response_time, ttft, error_message, metrics = result
+        return dict(metrics, model=model_name, response_time=response_time, ttft=ttft, error=error_message)
+
+    def run(self, progress=None):
+        # Models run one after another so they don't compete for the same GPU
+        samples = {}
+        for model_name in self.models:
+            # Warmup absorbs the model load so it doesn't skew the measured runs
+            for i in range(self.warmup):
+                self._sample(model_name, self.prompts[i % len(self.prompts)])
+            samples[model_name] = []
+            for i in range(self.repetitions):
+                sample = self._sample(model_name, self.prompts[i % len(self.prompts)])
+                samples[model_name].append(sample)
+                if progress:
+                    progress(sample)
+        return samples
+
+    def summarize(self, samples):
+        summary = {}
+        for model_name, model_samples in samples.items():
+            ok = [sample for sample in model_samples if not sample['error']]
+            stats = {'runs': len(model_samples), 'errors': len(model_samples) - len(ok)}
+            for metric in self.METRICS:
+                values = [sample[metric] for sample in ok if sample.get(metric) is not None]
+                stats[metric] = {
+                    'mean': sum(values) / len(values) if values else None,
+                    'p50': percentile(values, 50),
+                    'p95': percentile(values, 95),
+                    'p99': percentile(values, 99)
+                }
+            summary[model_name] = stats
+        return summary
@@ -0,0 +1,126 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .telemetry import CACHE_REQUESTS
+
+# Two-tier cache for generated responses keyed on (model digest, prompt, options): an in-memory
+# LRU in front of an optional table in the chat history database, both with TTL expiry
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=None, db_manager=None, max_db_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds before an entry expires, None keeps entries until evicted
+        self.db_manager = db_manager
+        self.max_db_entries = max_db_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (created, response)
+        self._lock = threading.Lock()
+        self._db_writes = 0
+        if db_manager:
+            with db_manager.connection('response_cache') as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS response_cache (
+                        key TEXT PRIMARY KEY,
+                        model_name TEXT,
+                        response TEXT,
+                        created REAL,
+                        last_used REAL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)')
+
+    @staticmethod
+    def make_key(model_digest, prompt, options=None):
+        payload = json.dumps([model_digest, prompt, options or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry[0], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(result='hit')
+                return entry[1]
+            self._entries.pop(key, None)
+        response = self._db_get(key, now)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(result='miss' if response is None else 'hit')
+        return response
+
+    def set(self, key, response, model_name=None):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.db_manager:
+            with self.db_manager.connection('response_cache') as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO response_cache (key, model_name, response, created, last_used)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (key, model_name, response, now, now))
+            self._db_writes += 1
+            # Trimming scans the table so only do it every so often
+            if self._db_writes % 100 == 0:
+                self.evict()
+
+    def _db_get(self, key, now):
+        if not self.db_manager:
+            return None
+        with self.db_manager.connection('response_cache') as conn:
+            row = conn.execute('SELECT response, created FROM response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1], now):
+                conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE response_cache SET last_used = ? WHERE key = ?', (now, key))
+        # Promote to the memory tier
+        with self._lock:
+            self._entries[key] = (row[1], row[0])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return row[0]
+
+    def evict(self):
+        # Drop expired rows, then the least recently used ones beyond max_db_entries
+        if not self.db_manager:
+            return
+        with self.db_manager.connection('response_cache') as conn:
+            if self.ttl is not None:
+                conn.execute('DELETE FROM response_cache WHERE created < ?', (time.time() - self.ttl,))
+            conn.execute('''
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_db_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_manager:
+            with self.db_manager.connection('response_cache') as conn:
+                conn.execute('DELETE FROM response_cache')
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries)
+            }
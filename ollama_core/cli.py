@@ -0,0 +1,689 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from .jobs import DEFAULT_JOB_WORKERS
+from .maintenance import ARCHIVE_COMPRESSIONS
+from .metrics import LATENCY_METRICS, format_seconds
+from .storage import DatabaseManager
+
+# The HTTP client, batch runner, benchmark and mock server are imported by the commands that use them,
+# so commands that only touch the database start without loading requests or concurrent.futures
+RESULT_FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+# Modules measured by the importtime command, and modules the core must never import on its own
+IMPORTTIME_MODULES = ('ollama_core', 'ollama_core.cli', 'ollama_core.storage', 'ollama_core.client')
+FRONTEND_MODULES = ('streamlit', 'gradio', 'pandas', 'numpy', 'pyarrow')
+# Same default as ollama_core.embeddings, which imports NumPy
+DEFAULT_EMBEDDING_MODEL = os.environ.get('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
+
+def rebuild_search_index_command(args):
+    db = DatabaseManager(args.db)
+    if not db.fts_enabled:
+        print('SQLite was built without FTS5, full-text search is not available.', file=sys.stderr)
+        return 1
+    start_time = time.time()
+    db.rebuild_search_index()
+    print(f'Search index rebuilt in {time.time() - start_time:.2f} seconds.')
+    return 0
+
+def batch_command(args):
+    from .batch import BatchRunner
+    from .cache import ResponseCache
+    from .client import OllamaAPIClient
+
+    client = OllamaAPIClient(base_url=args.host, max_workers=args.concurrency, timeout=args.timeout)
+    db = None if args.no_db else DatabaseManager(args.db)
+    if args.use_cache:
+        client.cache = ResponseCache(db_manager=db)
+    runner = BatchRunner(
+        client,
+        [model.strip() for model in args.models.split(',') if model.strip()],
+        concurrency=args.concurrency,
+        db_manager=db,
+        session_name=args.session,
+        options=json.loads(args.options) if args.options else None,
+        use_cache=args.use_cache,
+        prompt_field=args.prompt_field,
+        id_field=args.id_field
+    )
+    output = args.output or os.path.splitext(args.prompts)[0] + '.results.' + (args.format or 'jsonl')
+    start_time = time.time()
+
+    def progress(completed, failed, record):
+        status = f"error: {record['error']}" if record['error'] else f"{record['response_time']:.2f}s"
+        print(f"[{completed}] {record['id']} {record['model']} {status}", file=sys.stderr)
+
+    completed, failed, skipped = runner.run(args.prompts, output, args.format, args.checkpoint, progress)
+    print(
+        f'{completed} results ({failed} failed, {skipped} skipped from checkpoint) written to {runner.output_path} '
+        f'in {time.time() - start_time:.2f} seconds.'
+    )
+    if len(client.hosts.hosts) > 1:
+        print_host_stats(client)
+    return 1 if failed else 0
+
+def print_host_stats(client, file=sys.stdout):
+    print(f"{'host':<32} {'status':<8} {'requests':>8} {'errors':>6} {'latency':>10} {'models':>6}  loaded", file=file)
+    for stats in client.hosts.stats():
+        print(
+            f"{stats['host']:<32} {'up' if stats['healthy'] else 'down':<8} {stats['requests']:>8} "
+            f"{stats['errors']:>6} {format_seconds(stats['latency']):>10} "
+            f"{stats['models'] if stats['models'] is not None else '-':>6}  {', '.join(stats['loaded'])}",
+            file=file
+        )
+
+def _mock_server(args, host='127.0.0.1', port=0):
+    # MockOllamaServer configured by the options of _add_mock_arguments
+    from .mock import MockOllamaServer
+
+    return MockOllamaServer(
+        host=host, port=port, models=_split(args.mock_models), tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens, load_time=args.load_time, latency=args.latency,
+        error_rate=args.error_rate, error_status=args.error_status, disconnect_rate=args.disconnect_rate,
+        legacy_embeddings=args.legacy_embeddings, seed=args.seed
+    )
+
+def _split(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+def bench_command(args):
+    from .batch import BatchRunner
+    from .bench import Benchmark
+    from .client import OllamaAPIClient
+
+    mock = _mock_server(args).start() if args.mock else None
+    try:
+        client = OllamaAPIClient(base_url=mock.base_url if mock else args.host, timeout=args.timeout)
+        models = _split(args.models)
+        if not models:
+            models = mock.models if mock else []
+        if not models:
+            print('No models to benchmark, pass --models.', file=sys.stderr)
+            return 1
+        prompts = [args.prompt]
+        if args.prompts:
+            prompts = [prompt for _, prompt in BatchRunner(client, models).read_prompts(args.prompts)]
+        benchmark = Benchmark(
+            client, models, prompts, warmup=args.warmup, repetitions=args.repetitions,
+            stream=not args.no_stream, options=json.loads(args.options) if args.options else None
+        )
+        summary = benchmark.summarize(benchmark.run())
+    finally:
+        if mock:
+            mock.stop()
+
+    print(f"{'model':<30} {'runs':>5} {'err':>4} {'ttft p50':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'tok/s p50':>10}")
+    for model_name, stats in summary.items():
+        tokens_per_second = stats['tokens_per_second']['p50']
+        print(
+            f"{model_name:<30} {stats['runs']:>5} {stats['errors']:>4} "
+            f"{format_seconds(stats['ttft']['p50']):>10} "
+            f"{format_seconds(stats['response_time']['p50']):>10} "
+            f"{format_seconds(stats['response_time']['p95']):>10} "
+            f"{format_seconds(stats['response_time']['p99']):>10} "
+            f"{f'{tokens_per_second:.1f}' if tokens_per_second is not None else '-':>10}"
+        )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if any(stats['errors'] for stats in summary.values()) else 0
+
+def mock_command(args):
+    mock = _mock_server(args, args.bind, args.port).start()
+    print(
+        f"Mock Ollama serving {', '.join(mock.models + mock.embedding_models)} at {mock.base_url}, "
+        'press Ctrl+C to stop.', file=sys.stderr
+    )
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        mock.stop()
+        return 0
+
+def loadtest_command(args):
+    from .batch import BatchRunner
+    from .client import OllamaAPIClient
+    from .loadtest import LOAD_PERCENTILES, LoadGenerator
+    from .telemetry import REGISTRY
+
+    mock = _mock_server(args).start() if args.mock else None
+    try:
+        client = OllamaAPIClient(
+            base_url=mock.base_url if mock else args.host, timeout=args.timeout, pool_size=args.max_in_flight,
+            max_retries=args.max_retries
+        )
+        models = _split(args.models) or (mock.models if mock else [])
+        if not models:
+            print('No models to load test, pass --models.', file=sys.stderr)
+            return 1
+        prompts = [args.prompt]
+        if args.prompts:
+            prompts = [prompt for _, prompt in BatchRunner(client, models).read_prompts(args.prompts)]
+        generator = LoadGenerator(
+            client, models, prompts, qps=args.qps, duration=args.duration, stream=not args.no_stream,
+            chat=args.chat, arrivals=args.arrivals, max_in_flight=args.max_in_flight,
+            options=json.loads(args.options) if args.options else None, seed=args.seed
+        )
+        print(
+            f'Sending {args.qps:g} requests/s to {", ".join(models)} for {args.duration:g} seconds...', file=sys.stderr
+        )
+        summary = generator.summarize(*generator.run())
+    finally:
+        if mock:
+            mock.stop()
+
+    retries = sum(value for _, _, value in REGISTRY.collect()['ollama_request_retries_total'])
+    columns = ''.join(f"{f'p{p}':>9}" for p in LOAD_PERCENTILES)
+    print(f"{'model':<24} {'requests':>8} {'errors':>6} {'req/s':>7} {'tok/s':>8}  {'':<8}{columns}{'max':>9}")
+    for model_name, stats in list(summary['models'].items()) + [('total', summary['total'])]:
+        for i, metric in enumerate(('latency', 'ttft', 'start_delay')):
+            values = stats[metric]
+            if i == 0:
+                prefix = (
+                    f"{model_name:<24} {stats['requests']:>8} {stats['errors']:>6} {stats['qps']:>7.2f} "
+                    f"{stats['tokens_per_second']:>8.1f}"
+                )
+            else:
+                prefix = f"{'':<24} {'':>8} {'':>6} {'':>7} {'':>8}"
+            print(
+                f"{prefix}  {metric if metric != 'start_delay' else 'queued':<8}"
+                + ''.join(f"{format_seconds(values[f'p{p}']):>9}" for p in LOAD_PERCENTILES)
+                + f"{format_seconds(values['max']):>9}"
+            )
+    print(
+        f"Achieved {summary['total']['qps']:.2f} of {args.qps:g} requests/s over {summary['elapsed']:.1f} seconds, "
+        + (
+            f"{retries:g} retries (up to {args.max_retries} per request, errors only count requests that failed "
+            'every attempt).' if args.max_retries else 'retries off (every failed request counts as an error).'
+        )
+    )
+    for error_message, count in sorted(summary['errors'].items(), key=lambda item: -item[1])[:5]:
+        print(f'{count:>6}  {error_message}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['total']['errors'] else 0
+
+def hosts_command(args):
+    from .client import OllamaAPIClient
+
+    client = OllamaAPIClient(base_url=args.host)
+    client.registry.refresh()
+    client.residency.loaded_models(refresh=True)
+    print_host_stats(client)
+    return 0 if any(stats['healthy'] for stats in client.hosts.stats()) else 1
+
+def export_command(args):
+    from .export import export_conversations
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if fmt not in EXPORT_FORMATS:
+        print('Pass --format, the output extension is not one of csv, jsonl or parquet.', file=sys.stderr)
+        return 1
+    db = DatabaseManager(args.db)
+    session_id = None
+    if args.session:
+        session_id = db.find_session(args.session)
+        if session_id is None:
+            print(f'No session named {args.session!r}.', file=sys.stderr)
+            return 1
+    filters = {'session_id': session_id, 'model_name': args.model, 'since': args.since, 'before': args.before}
+    start_time = time.time()
+    if args.output == '-':
+        count = export_conversations(db, sys.stdout.buffer, fmt, args.chunk_size, **filters)
+    else:
+        with open(args.output, 'wb') as f:
+            count = export_conversations(db, f, fmt, args.chunk_size, **filters)
+    print(f'{count} conversations exported to {args.output} in {time.time() - start_time:.2f} seconds.', file=sys.stderr)
+    return 0
+
+def import_command(args):
+    from .importer import HistoryImporter
+
+    missing = [source for source in args.sources if not os.path.isfile(source)]
+    if missing:
+        print(f"No such file: {', '.join(missing)}.", file=sys.stderr)
+        return 1
+    db = DatabaseManager(args.db)
+    importer = HistoryImporter(
+        db, on_conflict=args.on_conflict, default_session=args.session, defer_indexes=args.defer_indexes
+    )
+    for source in args.sources:
+        start_time = time.time()
+        if source.lower().endswith(('.jsonl', '.json', '.jsonl.gz', '.json.gz')):
+            imported, duplicates, sessions_created, invalid = importer.import_jsonl(source)
+        else:
+            imported, duplicates, sessions_created, invalid = importer.import_sqlite(source)
+        elapsed = time.time() - start_time
+        print(
+            f'{source}: {imported} conversations imported, {duplicates} duplicates skipped, '
+            f'{invalid} incomplete records skipped, {sessions_created} sessions created in {elapsed:.2f} seconds '
+            f'({(imported + duplicates) / elapsed if elapsed else 0:.0f} rows/s).'
+        )
+    return 0
+
+def _embedding_index(args):
+    from .client import OllamaAPIClient
+    from .embeddings import EmbeddingIndex
+
+    return EmbeddingIndex(
+        DatabaseManager(args.db), OllamaAPIClient(base_url=args.host), model_name=args.embedding_model,
+        batch_size=getattr(args, 'batch_size', 32)
+    )
+
+def embed_command(args):
+    index = _embedding_index(args)
+    start_time = time.time()
+    count = index.backfill()
+    elapsed = time.time() - start_time
+    print(f'{count} conversations embedded with {index.model_name} in {elapsed:.2f} seconds.')
+    if index.error:
+        print(f'Embedding failed: {index.error}', file=sys.stderr)
+        return 1
+    return 0
+
+def semantic_search_command(args):
+    index = _embedding_index(args)
+    session_id = None
+    if args.session:
+        session_id = index.db_manager.find_session(args.session)
+        if session_id is None:
+            print(f'No session named {args.session!r}.', file=sys.stderr)
+            return 1
+    start_time = time.time()
+    results = index.search(args.query, session_id=session_id, limit=args.limit, model_name=args.model)
+    elapsed = time.time() - start_time
+    if index.error:
+        print(f'Embedding failed: {index.error}', file=sys.stderr)
+        return 1
+    sessions = dict(index.db_manager.load_sessions())
+    for conv_id, session_id, model_name, msg_timestamp, user_input, bot_response, score in results:
+        print(f"{score:.3f}  {sessions.get(session_id, '')} · {model_name} · {msg_timestamp}  {' '.join(user_input.split())[:80]}")
+    pending = index.stats()['pending']
+    print(
+        f'{len(results)} results in {elapsed * 1000:.0f} ms.' + (f' {pending} conversations are not embedded yet.' if pending else ''),
+        file=sys.stderr
+    )
+    return 0
+
+def worker_command(args):
+    from .cache import ResponseCache
+    from .client import OllamaAPIClient
+    from .jobs import JobQueue
+
+    db = DatabaseManager(args.db)
+    client = OllamaAPIClient(base_url=args.host, timeout=args.timeout, cache=ResponseCache(db_manager=db))
+
+    def on_done(job_id, rows):
+        print(f"Job {job_id} saved: {', '.join(row[1] for row in rows)}", file=sys.stderr)
+
+    jobs = JobQueue(db, client, workers=args.workers, on_done=on_done)
+    if args.once:
+        # Runs the queued jobs one after the other in this thread, then exits
+        count = 0
+        stop_heartbeat = jobs.keep_alive()
+        try:
+            while jobs.run_next(f'cli:{os.getpid()}') is not None:
+                count += 1
+        finally:
+            stop_heartbeat.set()
+        print(f'{count} jobs run.', file=sys.stderr)
+        return 0
+    jobs.start()
+    print(f'{args.workers} workers waiting for jobs in {args.db}, press Ctrl+C to stop.', file=sys.stderr)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        return 0
+
+def maintain_command(args):
+    from .maintenance import DatabaseMaintenance, default_archive_path
+
+    db = DatabaseManager(args.db)
+    archive = 'none' if args.no_archive else args.archive or default_archive_path(args.db)
+    try:
+        maintenance = DatabaseMaintenance(
+            db, max_age_days=args.max_age_days,
+            max_bytes=int(args.max_size_mb * 1024 * 1024) if args.max_size_mb is not None else None,
+            archive_path=archive, compression=args.compression, compress_min_bytes=args.compress_min_bytes
+        )
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    report = maintenance.run(dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"{report['sessions']} sessions ({report['conversations']} conversations) would be archived or deleted:")
+        for name in report['session_names']:
+            print(f'  {name}')
+        return 0
+    archived = f" archived to {report['archive']} and" if report['archive'] else ''
+    print(f"{report['sessions']} sessions ({report['conversations']} conversations){archived} deleted.")
+    for table, count in report['orphans'].items():
+        print(f'{count} orphan rows removed from {table}.')
+    if args.vacuum:
+        maintenance.vacuum()
+    stats = maintenance.stats()
+    print(
+        f"{report['pages_freed']} pages freed, database {report['size_before'] / 1e6:.1f} MB -> "
+        f"{stats['size'] / 1e6:.1f} MB ({stats['free'] / 1e6:.1f} MB free, auto_vacuum {stats['auto_vacuum']}) "
+        f"in {report['elapsed']:.2f} seconds."
+    )
+    if stats['auto_vacuum'] != 'incremental':
+        print('Run with --vacuum once to switch the database to incremental vacuum.', file=sys.stderr)
+    return 0
+
+def stats_command(args):
+    db = DatabaseManager(args.db)
+    print(f'{args.metric} percentiles over the last {args.days} days')
+    print(f"{'model':<30} {'count':>7} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for model_name, count, p50, p95, p99 in db.latency_percentiles(args.metric, args.model, args.days):
+        print(f'{model_name:<30} {count:>7} {format_seconds(p50):>10} {format_seconds(p95):>10} {format_seconds(p99):>10}')
+    print()
+    print(f"{'day':<12} {'model':<30} {'requests':>8} {'tok/s':>8} {'avg time':>10}")
+    for day, model_name, requests_count, tokens_per_second, avg_response_time in db.throughput_by_day(args.model, args.days):
+        print(
+            f"{day:<12} {model_name:<30} {requests_count:>8} "
+            f"{f'{tokens_per_second:.1f}' if tokens_per_second is not None else '-':>8} "
+            f"{format_seconds(avg_response_time):>10}"
+        )
+    return 0
+
+def _importtime(code):
+    # {module: (self seconds, cumulative seconds)} from `python -X importtime -c code` in a fresh interpreter
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    # Lines look like `import time:       228 |        228 |   package.module`, times in microseconds
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return times
+
+def measure_import_time(module, repeat=5):
+    # Best cumulative import time in seconds over `repeat` fresh interpreters, with the self time in
+    # seconds of every module the import pulled in beyond what interpreter startup already loads
+    startup = set(_importtime('pass'))
+    best = None
+    for _ in range(repeat):
+        times = _importtime(f'import {module}')
+        total = times.get(module, (0.0, 0.0))[1]
+        if best is None or total < best[0]:
+            best = (total, {name: times[name][0] for name in times if name not in startup})
+    return best
+
+def importtime_command(args):
+    modules = [module.strip() for module in args.modules.split(',') if module.strip()]
+    forbidden = [module.strip() for module in args.forbid.split(',') if module.strip()]
+    failed = False
+    print(f"{'module':<30} {'import time':>12}  slowest imports")
+    for module in modules:
+        total, self_times = measure_import_time(module, args.repeat)
+        slowest = sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        over_budget = args.budget_ms is not None and total * 1000 > args.budget_ms
+        print(
+            f"{module:<30} {format_seconds(total):>12}  "
+            + ', '.join(f'{name} {format_seconds(seconds)}' for name, seconds in slowest)
+            + ('  OVER BUDGET' if over_budget else '')
+        )
+        leaked = sorted({name.split('.')[0] for name in self_times} & set(forbidden))
+        if leaked:
+            print(f"{'':<30} {'':>12}  imports {', '.join(leaked)}")
+        failed = failed or over_budget or bool(leaked)
+    return 1 if failed else 0
+
+def _distribution(spec):
+    # argparse type of the mock options taking a number or a distribution
+    from .mock import parse_distribution
+
+    try:
+        return parse_distribution(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _add_mock_arguments(subparser):
+    group = subparser.add_argument_group('mock server', 'behaviour of the mock Ollama server')
+    group.add_argument('--mock-models', default='mock-small,mock-large', help='comma separated model names')
+    group.add_argument('--tokens-per-second', type=float, default=200, help='generation speed')
+    group.add_argument(
+        '--response-tokens', type=_distribution, default='32',
+        help="tokens per answer, a number or distribution, e.g. 'uniform:16,256'"
+    )
+    group.add_argument(
+        '--load-time', type=_distribution, default='0.2', help='seconds to load a model, a number or distribution'
+    )
+    group.add_argument(
+        '--latency', type=_distribution, default=None,
+        help="seconds added to each request, e.g. 0.05, 'uniform:0.01,0.1', 'normal:0.1,0.02', "
+             "'lognormal:0.1,0.5' (median, sigma) or 'exponential:0.1'"
+    )
+    group.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    group.add_argument('--error-status', type=int, default=500, help='HTTP status of injected errors')
+    group.add_argument(
+        '--disconnect-rate', type=float, default=0.0, help='share of streamed answers cut off halfway'
+    )
+    group.add_argument(
+        '--legacy-embeddings', action='store_true', help='only serve /api/embeddings, like older Ollama versions'
+    )
+    group.add_argument('--seed', type=int, help='random seed for distributions, arrivals and injected errors')
+
+# Command line entry point for headless tasks, e.g. `python -m ollama_core batch prompts.jsonl --models a,b`
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ollama_core', description='GoOllama command line tools')
+    parser.add_argument('--db', default='chat_history.db', help='path to the chat history database')
+    parser.add_argument(
+        '--host', default=os.environ.get('OLLAMA_HOSTS', 'http://localhost:11434'),
+        help='Ollama base URL, or several comma separated to balance requests across (default: $OLLAMA_HOSTS)'
+    )
+    parser.add_argument(
+        '--metrics-port', type=int, default=os.environ.get('OLLAMA_METRICS_PORT'),
+        help='serve Prometheus metrics at /metrics on this port while the command runs (default: $OLLAMA_METRICS_PORT)'
+    )
+    parser.add_argument(
+        '--metrics-addr', default=os.environ.get('OLLAMA_METRICS_ADDR') or '127.0.0.1',
+        help='address the metrics endpoint listens on, 0.0.0.0 for all interfaces (default: $OLLAMA_METRICS_ADDR '
+             'or 127.0.0.1)'
+    )
+    parser.add_argument('--metrics-file', help='write the collected metrics in Prometheus text format on exit')
+    parser.add_argument(
+        '--trace', default=os.environ.get('OLLAMA_TRACE_FILE'),
+        help='append a JSON line per timed span (requests, generations, DB transactions) to this file'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparser = subparsers.add_parser(
+        'rebuild-search-index', help='backfill the full-text search index from existing history'
+    )
+    subparser.set_defaults(func=rebuild_search_index_command)
+
+    subparser = subparsers.add_parser('batch', help='run a JSONL prompt file against several models')
+    subparser.add_argument('prompts', help='JSONL file with one prompt object (or string) per line')
+    subparser.add_argument('--models', required=True, help='comma separated model names')
+    subparser.add_argument('--output', help='result file, defaults to <prompts>.results.<format>')
+    subparser.add_argument('--format', choices=RESULT_FORMATS, help='output format, defaults to the output extension')
+    subparser.add_argument('--checkpoint', help='checkpoint file, defaults to <output>.checkpoint')
+    subparser.add_argument('--concurrency', type=int, default=4, help='maximum requests in flight')
+    subparser.add_argument('--timeout', type=float, default=300, help='per-request read timeout in seconds')
+    subparser.add_argument('--session', help='session name for the saved conversations')
+    subparser.add_argument('--no-db', action='store_true', help="don't save results to the conversations table")
+    subparser.add_argument('--options', help='generation options as a JSON object, e.g. \'{"temperature": 0}\'')
+    subparser.add_argument('--use-cache', action='store_true', help='reuse cached responses for identical requests')
+    subparser.add_argument('--prompt-field', default='prompt', help='JSON field holding the prompt text')
+    subparser.add_argument('--id-field', default='id', help='JSON field holding the prompt id')
+    subparser.set_defaults(func=batch_command)
+
+    subparser = subparsers.add_parser('bench', help='measure TTFT, latency percentiles and tokens/sec per model')
+    subparser.add_argument('--models', help='comma separated model names, defaults to all models of --mock')
+    subparser.add_argument('--prompt', default='Write a haiku about the sea.', help='prompt to send')
+    subparser.add_argument('--prompts', help='JSONL prompt file, cycled through across repetitions')
+    subparser.add_argument('--warmup', type=int, default=1, help='unmeasured runs per model')
+    subparser.add_argument('--repetitions', type=int, default=10, help='measured runs per model')
+    subparser.add_argument('--no-stream', action='store_true', help="use non-streaming requests (no TTFT)")
+    subparser.add_argument('--options', help='generation options as a JSON object')
+    subparser.add_argument('--timeout', type=float, default=300, help='per-request read timeout in seconds')
+    subparser.add_argument('--mock', action='store_true', help='benchmark against a built-in mock Ollama server')
+    subparser.add_argument('--output', help='write the summary as JSON to this file')
+    _add_mock_arguments(subparser)
+    subparser.set_defaults(func=bench_command)
+
+    subparser = subparsers.add_parser(
+        'loadtest', help='send requests at a target rate and report throughput and tail latency'
+    )
+    subparser.add_argument('--models', help='comma separated model names, requests cycle through them')
+    subparser.add_argument('--qps', type=float, default=5, help='requests started per second')
+    subparser.add_argument('--duration', type=float, default=30, help='seconds during which requests are started')
+    subparser.add_argument(
+        '--arrivals', choices=('constant', 'poisson'), default='constant',
+        help='evenly spaced requests, or random arrivals averaging --qps'
+    )
+    subparser.add_argument('--max-in-flight', type=int, default=64, help='requests running at the same time')
+    subparser.add_argument('--prompt', default='Write a haiku about the sea.', help='prompt to send')
+    subparser.add_argument('--prompts', help='JSONL prompt file, cycled through')
+    subparser.add_argument('--chat', action='store_true', help='send prompts through /api/chat')
+    subparser.add_argument('--no-stream', action='store_true', help='use non-streaming requests (no TTFT)')
+    subparser.add_argument('--options', help='generation options as a JSON object')
+    subparser.add_argument('--timeout', type=float, default=300, help='per-request read timeout in seconds')
+    subparser.add_argument(
+        '--max-retries', type=int, default=0,
+        help='retry failed requests like the apps do, by default every failure is reported as an error'
+    )
+    subparser.add_argument('--mock', action='store_true', help='load test a built-in mock Ollama server')
+    subparser.add_argument('--output', help='write the summary as JSON to this file')
+    _add_mock_arguments(subparser)
+    subparser.set_defaults(func=loadtest_command)
+
+    subparser = subparsers.add_parser(
+        'mock', help='serve a mock Ollama API, e.g. to run the apps or load tests without a GPU'
+    )
+    subparser.add_argument('--bind', default='127.0.0.1', help='address to listen on')
+    subparser.add_argument('--port', type=int, default=11434, help='port to listen on')
+    _add_mock_arguments(subparser)
+    subparser.set_defaults(func=mock_command)
+
+    subparser = subparsers.add_parser('stats', help='show latency percentiles and tokens/sec from saved history')
+    subparser.add_argument('--model', help='only show this model')
+    subparser.add_argument('--days', type=int, default=30, help='look back this many days')
+    subparser.add_argument('--metric', default='response_time', choices=LATENCY_METRICS, help='latency metric')
+    subparser.set_defaults(func=stats_command)
+
+    subparser = subparsers.add_parser('export', help='stream conversations to CSV, JSONL or Parquet')
+    subparser.add_argument('output', help='output file, - writes to stdout')
+    subparser.add_argument('--format', choices=EXPORT_FORMATS, help='output format, defaults to the output extension')
+    subparser.add_argument('--session', help='only export this session')
+    subparser.add_argument('--model', help='only export this model')
+    subparser.add_argument('--since', help='only export conversations at or after this time, e.g. 2024-05-01')
+    subparser.add_argument('--before', help='only export conversations before this time, e.g. 2024-06-01')
+    subparser.add_argument('--chunk-size', type=int, default=1000, help='rows read and written at a time')
+    subparser.set_defaults(func=export_command)
+
+    subparser = subparsers.add_parser('import', help='merge other chat history databases or JSONL exports')
+    subparser.add_argument(
+        'sources', nargs='+', help='chat_history.db files, archives or .jsonl exports (.jsonl.gz when compressed)'
+    )
+    subparser.add_argument(
+        '--on-conflict', choices=('merge', 'rename'), default='merge',
+        help='add to an existing session of the same name, or import it as "name (2)"'
+    )
+    subparser.add_argument('--session', default='Imported', help='session for rows that name none')
+    subparser.add_argument(
+        '--defer-indexes', action=argparse.BooleanOptionalAction, default=None,
+        help='drop secondary indexes during the import and rebuild them after, decided by size by default'
+    )
+    subparser.set_defaults(func=import_command)
+
+    subparser = subparsers.add_parser('embed', help='compute embeddings for semantic search of saved history')
+    subparser.add_argument('--embedding-model', default=DEFAULT_EMBEDDING_MODEL, help='Ollama embedding model')
+    subparser.add_argument('--batch-size', type=int, default=32, help='prompts embedded per request')
+    subparser.set_defaults(func=embed_command)
+
+    subparser = subparsers.add_parser('semantic-search', help='find saved prompts similar in meaning to a query')
+    subparser.add_argument('query')
+    subparser.add_argument('--embedding-model', default=DEFAULT_EMBEDDING_MODEL, help='Ollama embedding model')
+    subparser.add_argument('--session', help='only search this session')
+    subparser.add_argument('--model', help='only return answers from this model')
+    subparser.add_argument('--limit', type=int, default=10, help='number of results')
+    subparser.set_defaults(func=semantic_search_command)
+
+    subparser = subparsers.add_parser('worker', help='run queued generation jobs submitted by the apps')
+    subparser.add_argument('--workers', type=int, default=DEFAULT_JOB_WORKERS, help='jobs run at the same time')
+    subparser.add_argument('--timeout', type=float, default=300, help='per-request read timeout in seconds')
+    subparser.add_argument('--once', action='store_true', help='run the jobs queued now, then exit')
+    subparser.set_defaults(func=worker_command)
+
+    subparser = subparsers.add_parser(
+        'maintain', help='archive old sessions, remove orphan rows and return free space to the file system'
+    )
+    subparser.add_argument(
+        '--max-age-days', type=float, default=os.environ.get('OLLAMA_RETENTION_DAYS'),
+        help='archive sessions without activity for this many days (default: $OLLAMA_RETENTION_DAYS)'
+    )
+    subparser.add_argument(
+        '--max-size-mb', type=float, default=os.environ.get('OLLAMA_MAX_DB_MB'),
+        help='archive the oldest sessions while the live data is larger than this (default: $OLLAMA_MAX_DB_MB)'
+    )
+    subparser.add_argument(
+        '--archive', default=os.environ.get('OLLAMA_ARCHIVE_PATH'),
+        help='cold SQLite database, or .jsonl.gz file, receiving archived sessions (default: <db>.archive.db)'
+    )
+    subparser.add_argument('--no-archive', action='store_true', help='delete expired sessions without archiving them')
+    subparser.add_argument(
+        '--compression', choices=ARCHIVE_COMPRESSIONS, default='zlib',
+        help='codec of large answers in a cold archive database, zstd needs the zstandard package'
+    )
+    subparser.add_argument(
+        '--compress-min-bytes', type=int, default=1024, help='answers shorter than this are archived uncompressed'
+    )
+    subparser.add_argument('--dry-run', action='store_true', help='list the sessions that would be archived')
+    subparser.add_argument(
+        '--vacuum', action='store_true',
+        help='also rewrite the whole database with VACUUM, which blocks the apps while it runs'
+    )
+    subparser.set_defaults(func=maintain_command)
+
+    subparser = subparsers.add_parser('hosts', help='show health, models and latency of each Ollama host')
+    subparser.set_defaults(func=hosts_command)
+
+    subparser = subparsers.add_parser(
+        'importtime', help='measure module import times with `python -X importtime` to catch slow startups'
+    )
+    subparser.add_argument('--modules', default=','.join(IMPORTTIME_MODULES), help='comma separated modules to import')
+    subparser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per module, the best run counts')
+    subparser.add_argument('--top', type=int, default=3, help='slowest imports to list per module')
+    subparser.add_argument('--budget-ms', type=float, help='fail when a module takes longer than this to import')
+    subparser.add_argument(
+        '--forbid', default=','.join(FRONTEND_MODULES), help='fail when one of these packages gets imported'
+    )
+    subparser.set_defaults(func=importtime_command)
+
+    args = parser.parse_args(argv)
+    if args.metrics_port is None and not args.metrics_file and not args.trace:
+        return args.func(args)
+
+    from . import telemetry
+
+    if args.metrics_port is not None:
+        telemetry.start_http_server(int(args.metrics_port), args.metrics_addr)
+    exporter = telemetry.JsonlSpanExporter(args.trace) if args.trace else None
+    if exporter:
+        telemetry.add_span_exporter(exporter)
+    try:
+        return args.func(args)
+    finally:
+        if exporter:
+            telemetry.remove_span_exporter(exporter)
+            exporter.close()
+        if args.metrics_file:
+            with open(args.metrics_file, 'w', encoding='utf-8') as f:
+                f.write(telemetry.REGISTRY.render())
@@ -0,0 +1,711 @@
+import sys
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .metrics import extract_metrics
+from .telemetry import (
+    IN_FLIGHT, REQUEST_DURATION, REQUEST_ERRORS, REQUESTS, RETRIES, TOKENS_PER_SECOND, TTFT, span, start_span, use_span
+)
+
+# Build the endpoint and payload for a prompt, or for a chat when a message list is given
+def build_generate_request(model_name, user_input, stream, options=None, messages=None, keep_alive=None):
+    if messages is not None:
+        path = '/api/chat'
+        data = {'model': model_name, 'messages': messages, 'stream': stream}
+    else:
+        path = '/api/generate'
+        data = {'model': model_name, 'prompt': user_input, 'stream': stream}
+    if options:
+        data['options'] = options
+    if keep_alive is not None:
+        data['keep_alive'] = keep_alive
+    return path, data
+
+# Text carried by a /api/generate or /api/chat response chunk
+def response_text(chunk):
+    message = chunk.get('message')
+    if message is not None:
+        return message.get('content', '')
+    return chunk.get('response', '')
+
+# Iterable over a streamed /api/generate or /api/chat call, yields tokens and records timings as they arrive
+class ResponseStream:
+    def __init__(self, client, model_name, user_input, timeout=None, options=None, use_cache=False, messages=None):
+        self.client = client
+        self.model_name = model_name
+        self.user_input = user_input
+        self.timeout = timeout
+        self.options = options
+        self.use_cache = use_cache
+        self.messages = messages
+        self.cached = False
+        self.chunks = []
+        self.ttft = None  # Time to first token in seconds
+        self.response_time = None  # Total time in seconds
+        self.error = None
+        self.final = {}  # Last NDJSON chunk with Ollama's timing fields
+        self.host = None  # Base URL of the Ollama host that answered
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    @property
+    def metrics(self):
+        return extract_metrics(self.final)
+
+    def __iter__(self):
+        path, data = build_generate_request(
+            self.model_name, self.user_input, True, self.options, self.messages,
+            self.client.residency.keep_alive_for(self.model_name)
+        )
+        start_time = time.perf_counter()
+        # The span stays open across yields, so it is ended explicitly instead of being made current
+        generate_span = start_span('ollama.generate', model=self.model_name, stream=True)
+        cache_key = None
+        if self.use_cache:
+            cache_key = self.client._cache_key(self.model_name, self.messages or self.user_input, self.options)
+        if cache_key:
+            cached_response = self.client.cache.get(cache_key)
+            if cached_response is not None:
+                self.cached = True
+                self.ttft = self.response_time = time.perf_counter() - start_time
+                self.chunks.append(cached_response)
+                generate_span.set(cached=True)
+                generate_span.end()
+                yield cached_response
+                return
+        response = None
+        try:
+            with use_span(generate_span):
+                response = self.client._request(
+                    'POST', path, json=data, stream=True, timeout=self.timeout, model_name=self.model_name
+                )
+            with response:
+                self.host = response.ollama_host.base_url
+                if response.status_code != 200:
+                    try:
+                        self.error = response.json().get('error', 'Unknown error.')
+                    except ValueError:
+                        self.error = f'HTTP {response.status_code}'
+                    return
+                # Ollama sends one JSON object per line until a chunk with done=true
+                for line in response.iter_lines(chunk_size=None):
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        self.error = chunk['error']
+                        break
+                    token = response_text(chunk)
+                    if token:
+                        if self.ttft is None:
+                            self.ttft = time.perf_counter() - start_time
+                        self.chunks.append(token)
+                        yield token
+                    if chunk.get('done'):
+                        self.final = chunk
+                        break
+            if cache_key and not self.error and self.final:
+                self.client.cache.set(cache_key, self.text, self.model_name)
+        except requests.exceptions.RequestException as e:
+            self.error = str(e)
+        finally:
+            self.response_time = time.perf_counter() - start_time
+            if response is not None:
+                self.client._release(response)
+                if self.error:
+                    REQUEST_ERRORS.inc(model=self.model_name, host=self.host, kind='api')
+            if self.ttft is not None:
+                TTFT.observe(self.ttft, model=self.model_name)
+            self.client._observe_generation(self.model_name, self.final)
+            generate_span.set(host=self.host, ttft=self.ttft, chunks=len(self.chunks))
+            generate_span.end(error=self.error)
+
+# One Ollama endpoint with the bookkeeping used for routing: models it serves, models it has loaded,
+# requests in flight, a moving average of its latency and whether it is in a failure cooldown
+class OllamaHost:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.models = None  # Names of the models it serves, None until discovered
+        self.loaded = set()  # Names of the models currently in its memory
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency = None  # Exponentially weighted average request latency in seconds
+        self.down_until = 0.0
+
+    @property
+    def healthy(self):
+        return time.time() >= self.down_until
+
+# Pool of Ollama hosts. Requests for a model go to a healthy host serving it, preferring hosts that
+# already have it loaded, then the one with the fewest requests in flight and the lowest latency.
+class HostPool:
+    def __init__(self, base_urls, cooldown=30, latency_alpha=0.2):
+        self.hosts = [OllamaHost(base_url) for base_url in base_urls]
+        self.cooldown = cooldown  # Seconds a host is skipped after a connection failure
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+
+    def choose(self, model_name=None, exclude=()):
+        # Picks a host and counts the request as in flight until release() is called
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude] or self.hosts
+            candidates = [host for host in candidates if host.healthy] or candidates
+            if model_name:
+                serving = [host for host in candidates if host.models is None or model_name in host.models]
+                candidates = serving or candidates
+                candidates = [host for host in candidates if model_name in host.loaded] or candidates
+            host = min(candidates, key=lambda host: (host.in_flight, host.latency or 0.0))
+            host.in_flight += 1
+            host.requests += 1
+        IN_FLIGHT.inc(host=host.base_url)
+        return host
+
+    def release(self, host, latency=None, ok=True):
+        IN_FLIGHT.dec(host=host.base_url)
+        with self._lock:
+            host.in_flight -= 1
+            if not ok:
+                host.errors += 1
+            elif latency is not None:
+                if host.latency is None:
+                    host.latency = latency
+                else:
+                    host.latency += self.latency_alpha * (latency - host.latency)
+
+    def mark_down(self, host):
+        with self._lock:
+            host.down_until = time.time() + self.cooldown
+
+    def mark_up(self, host):
+        with self._lock:
+            host.down_until = 0.0
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    'host': host.base_url,
+                    'healthy': host.healthy,
+                    'in_flight': host.in_flight,
+                    'requests': host.requests,
+                    'errors': host.errors,
+                    'latency': host.latency,
+                    'models': len(host.models) if host.models is not None else None,
+                    'loaded': sorted(host.loaded)
+                }
+                for host in self.hosts
+            ]
+
+# Cached view of the models served by Ollama (/api/tags). Stale data is returned immediately
+# while a background thread refreshes it, so UI reruns never wait on the network once loaded.
+class ModelRegistry:
+    def __init__(self, client, ttl=60):
+        self.client = client
+        self.ttl = ttl  # Seconds before the catalog is refreshed in the background
+        self.error = None  # Last refresh error, cleared on success
+        self._models = {}  # name -> metadata dict
+        self._fetched_at = None
+        self._refreshing = False
+        self._first_load = threading.Event()  # Set once the first refresh has finished
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(model):
+        details = model.get('details') or {}
+        return {
+            'name': model['name'],
+            'size': model.get('size'),
+            'digest': model.get('digest'),
+            'modified_at': model.get('modified_at'),
+            'family': details.get('family'),
+            'families': details.get('families'),
+            'parameter_size': details.get('parameter_size'),
+            'quantization_level': details.get('quantization_level')
+        }
+
+    def refresh(self):
+        # Asks every host for its models so requests can be routed to hosts that serve them
+        models = {}
+        errors = []
+        try:
+            for host in self.client.hosts.hosts:
+                if not host.healthy:
+                    # Failed recently, asked again once its cooldown is over
+                    errors.append(f'{host.base_url}: unreachable, retrying in {host.down_until - time.time():.0f}s')
+                    continue
+                try:
+                    response = self.client._host_request(host, 'GET', '/api/tags')
+                    if response.status_code != 200:
+                        errors.append(f'{host.base_url}: HTTP {response.status_code}')
+                        continue
+                    host_models = [self._parse(model) for model in response.json().get('models', [])]
+                    host.models = {model['name'] for model in host_models}
+                    for model in host_models:
+                        models.setdefault(model['name'], model)
+                    self.client.hosts.mark_up(host)
+                except requests.exceptions.RequestException as e:
+                    self.client.hosts.mark_down(host)
+                    errors.append(f'{host.base_url}: {e}')
+            if len(errors) < len(self.client.hosts.hosts):
+                with self._lock:
+                    self._models = models
+                    self._fetched_at = time.time()
+            self.error = '; '.join(errors) or None
+        finally:
+            self._refreshing = False
+            self._first_load.set()
+        return self._models
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def prefetch(self):
+        # Start the first load in the background so startup can do other work meanwhile
+        if self._fetched_at is None:
+            self._refresh_in_background()
+
+    def models(self):
+        # Block only for the very first load, later calls serve cached data and refresh when stale. When the
+        # first load failed the empty list is served while the next attempt runs in the background.
+        if self._fetched_at is None:
+            if self._first_load.is_set():
+                self._refresh_in_background()
+                return self._models
+            if self._refreshing:
+                self._first_load.wait()
+                return self._models
+            return self.refresh()
+        if time.time() - self._fetched_at > self.ttl:
+            self._refresh_in_background()
+        return self._models
+
+    def names(self):
+        return list(self.models())
+
+    def get(self, name, refresh_if_missing=False):
+        model = self.models().get(name)
+        if model is None and refresh_if_missing:
+            model = self.refresh().get(name)
+        return model
+
+    def digest(self, name):
+        model = self.get(name, refresh_if_missing=True)
+        return model['digest'] if model else None
+
+# Keeps selected models resident in Ollama: warms them ahead of use, sets keep_alive per model, reads
+# what is loaded from /api/ps and groups multi-model requests so each group fits in the memory budget
+class ModelResidencyManager:
+    def __init__(self, client, memory_budget=None, default_keep_alive=None, ps_ttl=5):
+        self.client = client
+        self.memory_budget = memory_budget  # Bytes available for loaded models, None means unlimited
+        self.default_keep_alive = default_keep_alive  # e.g. '30m', -1 keeps models loaded indefinitely
+        self.ps_ttl = ps_ttl
+        self.keep_alive = {}  # Per-model keep_alive overrides
+        self.warm_times = {}  # model name -> seconds the last warmup spent loading it
+        self._loaded = {}
+        self._loaded_at = None
+        self._warming = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='model-warmup')
+
+    def keep_alive_for(self, model_name):
+        return self.keep_alive.get(model_name, self.default_keep_alive)
+
+    def set_keep_alive(self, model_name, keep_alive):
+        self.keep_alive[model_name] = keep_alive
+
+    def loaded_models(self, refresh=False):
+        # name -> {'size', 'size_vram', 'expires_at'} of models currently in memory, cached for ps_ttl seconds
+        # across all hosts, also recording on each host what it has loaded for routing
+        if refresh or self._loaded_at is None or time.time() - self._loaded_at > self.ps_ttl:
+            loaded = {}
+            for host in self.client.hosts.hosts:
+                if not host.healthy:
+                    continue
+                try:
+                    response = self.client._host_request(host, 'GET', '/api/ps', timeout=10)
+                    if response.status_code != 200:
+                        continue
+                    host_models = response.json().get('models', [])
+                    host.loaded = {model['name'] for model in host_models}
+                    for model in host_models:
+                        loaded.setdefault(model['name'], {
+                            'size': model.get('size'),
+                            'size_vram': model.get('size_vram'),
+                            'expires_at': model.get('expires_at')
+                        })
+                except requests.exceptions.RequestException:
+                    # Skipped for the cooldown, so an unreachable host doesn't hold up every rerun
+                    self.client.hosts.mark_down(host)
+                except ValueError:
+                    continue
+            self._loaded = loaded
+            self._loaded_at = time.time()
+        return self._loaded
+
+    def is_loaded(self, model_name):
+        return model_name in self.loaded_models()
+
+    def warm(self, model_name, keep_alive=None):
+        # A generate request without a prompt only loads the model. Returns the load time in seconds.
+        data = {'model': model_name, 'stream': False}
+        keep_alive = keep_alive if keep_alive is not None else self.keep_alive_for(model_name)
+        if keep_alive is not None:
+            data['keep_alive'] = keep_alive
+        start_time = time.perf_counter()
+        try:
+            response = self.client._request('POST', '/api/generate', json=data, model_name=model_name)
+            load_time = time.perf_counter() - start_time
+            if response.status_code == 200:
+                response.ollama_host.loaded.add(model_name)
+                load_duration = response.json().get('load_duration')
+                if load_duration is not None:
+                    load_time = load_duration / 1e9
+                self.warm_times[model_name] = load_time
+                self._loaded_at = None  # /api/ps is stale now
+                return load_time
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._warming.discard(model_name)
+        return None
+
+    def warm_async(self, model_names):
+        # Load models in the background, skipping ones already loaded or being loaded
+        loaded = self.loaded_models()
+        for model_name in self.schedule(model_names)[0]:
+            with self._lock:
+                if model_name in loaded or model_name in self._warming:
+                    continue
+                self._warming.add(model_name)
+            self._executor.submit(self.warm, model_name)
+
+    def model_size(self, model_name):
+        loaded = self.loaded_models().get(model_name)
+        if loaded and loaded.get('size'):
+            return loaded['size']
+        model = self.client.registry.get(model_name)
+        return (model or {}).get('size') or 0
+
+    def schedule(self, model_names):
+        # Split models into groups that fit the memory budget together. Models already loaded go first
+        # so the first group runs warm, the rest are packed first-fit by decreasing size.
+        model_names = list(dict.fromkeys(model_names))
+        if not self.memory_budget or len(model_names) < 2:
+            return [model_names] if model_names else []
+        loaded = self.loaded_models()
+        ordered = [name for name in model_names if name in loaded]
+        ordered += sorted(
+            (name for name in model_names if name not in loaded), key=self.model_size, reverse=True
+        )
+        groups = []
+        for model_name in ordered:
+            size = self.model_size(model_name)
+            for group in groups:
+                if group['size'] + size <= self.memory_budget:
+                    group['models'].append(model_name)
+                    group['size'] += size
+                    break
+            else:
+                groups.append({'models': [model_name], 'size': size})
+        return [group['models'] for group in groups]
+
+# Ollama client class for managing API calls and model interactions
+class OllamaAPIClient:
+    def __init__(self, base_url='http://localhost:11434', max_workers=4, timeout=300,
+                 connect_timeout=5, pool_size=10, max_retries=3, backoff_factor=0.5, backoff_max=10, cache=None,
+                 models_ttl=60, memory_budget=None, keep_alive=None, host_cooldown=30, on_error=None):
+        # base_url may list several Ollama hosts, as a list or comma separated, to balance requests across
+        if isinstance(base_url, str):
+            base_url = [url.strip() for url in base_url.split(',') if url.strip()]
+        self.hosts = HostPool(base_url, cooldown=host_cooldown)
+        self.base_url = self.hosts.hosts[0].base_url
+        self.cache = cache  # Optional ResponseCache, used by calls made with use_cache=True
+        self.registry = ModelRegistry(self, ttl=models_ttl)
+        self.residency = ModelResidencyManager(self, memory_budget=memory_budget, default_keep_alive=keep_alive)
+        self.max_workers = max_workers  # Concurrency cap for multi-model fan-out
+        self.timeout = timeout  # Per-model read timeout in seconds
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries  # Retries on connection errors and 5xx responses
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        # Called with user-facing error messages, e.g. st.error, defaults to printing them to stderr
+        self.on_error = on_error or (lambda message: print(message, file=sys.stderr))
+
+        # One pooled session so connections are kept alive and reused across requests and threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt):
+        # Exponential backoff with full jitter so parallel requests don't retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def _host_request(self, host, method, path, timeout=None, **kwargs):
+        # Single request to a specific host, used for discovery and health checks
+        return self.session.request(
+            method, f'{host.base_url}{path}', timeout=(self.connect_timeout, timeout or self.timeout), **kwargs
+        )
+
+    def _request(self, method, path, timeout=None, model_name=None, **kwargs):
+        # Sends the request to the best host for model_name, failing over to other hosts on connection
+        # errors, timeouts and 5xx responses. The response's ollama_host attribute names the host that answered.
+        # Streamed responses keep their in-flight slot until _release() is called.
+        timeout = (self.connect_timeout, timeout or self.timeout)
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            host = self.hosts.choose(model_name, exclude=tried)
+            start_time = time.perf_counter()
+            # For streams the span ends when the response headers arrive
+            with span('ollama.request', method=method, path=path, model=model_name, host=host.base_url,
+                      attempt=attempt) as request_span:
+                try:
+                    response = self.session.request(method, f'{host.base_url}{path}', timeout=timeout, **kwargs)
+                except requests.exceptions.RequestException as e:
+                    self.hosts.release(host, ok=False)
+                    if isinstance(e, requests.exceptions.ConnectionError):
+                        # Connect timeouts included. A read timeout only means this request was slow,
+                        # so the host stays in rotation.
+                        self.hosts.mark_down(host)
+                        kind = 'connection'
+                    else:
+                        kind = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'request'
+                    REQUEST_ERRORS.inc(model=model_name, host=host.base_url, kind=kind)
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    request_span.set(status=response.status_code)
+                    if response.status_code < 500 or attempt == self.max_retries:
+                        response.ollama_host = host
+                        response.started_at = start_time
+                        response.model_name = model_name
+                        response.endpoint = path
+                        if not kwargs.get('stream'):
+                            self._release(response)
+                        return response
+                    response.close()
+                    self.hosts.release(host, ok=False)
+                    REQUEST_ERRORS.inc(model=model_name, host=host.base_url, kind='http_5xx')
+            RETRIES.inc(host=host.base_url)
+            if host not in tried:
+                tried.append(host)
+            # Fail over to an untried host right away, back off once every host has failed
+            if len(tried) < len(self.hosts.hosts):
+                continue
+            time.sleep(self._backoff(attempt))
+
+    def _release(self, response):
+        latency = time.perf_counter() - response.started_at
+        host = response.ollama_host
+        self.hosts.release(host, latency, ok=response.status_code < 500)
+        REQUESTS.inc(model=response.model_name, host=host.base_url, endpoint=response.endpoint, status=response.status_code)
+        REQUEST_DURATION.observe(latency, model=response.model_name, host=host.base_url, endpoint=response.endpoint)
+
+    @staticmethod
+    def _observe_generation(model_name, result):
+        tokens_per_second = extract_metrics(result)['tokens_per_second'] if result else None
+        if tokens_per_second:
+            TOKENS_PER_SECOND.observe(tokens_per_second, model=model_name)
+
+    def get_available_models(self):
+        models = self.registry.names()
+        if not models and self.registry.error:
+            self.on_error(f"Error retrieving model list: {self.registry.error}")
+        return models
+
+    def _cache_key(self, model_name, user_input, options=None):
+        if not self.cache:
+            return None
+        # The digest changes when a model is re-pulled, which invalidates its cached responses
+        digest = self.registry.digest(model_name)
+        if digest is None:
+            return None  # Unknown model, never serve it from the cache
+        return self.cache.make_key(digest, user_input, options)
+
+    def _post_generate(self, model_name, user_input, timeout=None, options=None, use_cache=False, messages=None):
+        # Returns (response, response_time, ttft, error, metrics) without touching the UI so it is safe in worker threads.
+        # With a message list the request goes to /api/chat instead of /api/generate.
+        with span('ollama.generate', model=model_name, stream=False) as generate_span:
+            result = self._post_generate_request(model_name, user_input, timeout, options, use_cache, messages)
+            if result[3]:
+                generate_span.set(error=result[3])
+            return result
+
+    def _post_generate_request(self, model_name, user_input, timeout, options, use_cache, messages):
+        headers = {'Content-Type': 'application/json'}
+        path, data = build_generate_request(
+            model_name, user_input, False, options, messages, self.residency.keep_alive_for(model_name)
+        )
+        start_time = time.perf_counter()
+        cache_key = self._cache_key(model_name, messages or user_input, options) if use_cache else None
+        if cache_key:
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response, time.perf_counter() - start_time, None, None, {}
+        try:
+            response = self._request(
+                'POST', path, headers=headers, data=json.dumps(data), timeout=timeout, model_name=model_name
+            )
+        except requests.exceptions.RequestException as e:
+            return '', time.perf_counter() - start_time, None, str(e), {}
+        end_time = time.perf_counter()
+        response_time = end_time - start_time  # Calculate response time
+        if response.status_code == 200:
+            result = response.json()
+            bot_response = response_text(result)
+            if cache_key:
+                self.cache.set(cache_key, bot_response, model_name)
+            self._observe_generation(model_name, result)
+            return bot_response, response_time, None, None, extract_metrics(result)
+        REQUEST_ERRORS.inc(model=model_name, host=response.ollama_host.base_url, kind='api')
+        try:
+            error_message = response.json().get('error', 'Unknown error.')
+        except ValueError:
+            error_message = f'HTTP {response.status_code}'
+        return '', response_time, None, error_message, {}
+
+    def _consume_stream(self, model_name, user_input, timeout, options, use_cache, messages, events):
+        # Worker side of a streamed fan-out, forwards tokens to the calling thread through a queue
+        stream = self.stream_response(model_name, user_input, timeout, options, use_cache, messages)
+        for token in stream:
+            events.put((model_name, token))
+        return stream.text, stream.response_time, stream.ttft, stream.error, stream.metrics
+
+    @staticmethod
+    def _error_message(response):
+        try:
+            return response.json().get('error', 'Unknown error.')
+        except ValueError:
+            return f'HTTP {response.status_code}'
+
+    def embed(self, model_name, texts, timeout=None):
+        # Embeds a batch of texts in one /api/embed request, or one /api/embeddings request per text on
+        # servers that predate the batch endpoint. Returns (embeddings, error_message) without touching the UI.
+        with span('ollama.embed', model=model_name, texts=len(texts)) as embed_span:
+            embeddings, error_message = self._post_embed(model_name, texts, timeout)
+            if error_message:
+                embed_span.set(error=error_message)
+            return embeddings, error_message
+
+    def _post_embed(self, model_name, texts, timeout):
+        headers = {'Content-Type': 'application/json'}
+        try:
+            response = self._request(
+                'POST', '/api/embed', headers=headers, data=json.dumps({'model': model_name, 'input': list(texts)}),
+                timeout=timeout, model_name=model_name
+            )
+            if response.status_code == 200:
+                return response.json()['embeddings'], None
+            # Older servers answer the unknown route with a plain-text 404, a missing model is a JSON error
+            if response.status_code != 404 or response.headers.get('Content-Type', '').startswith('application/json'):
+                return [], self._error_message(response)
+            embeddings = []
+            for text in texts:
+                response = self._request(
+                    'POST', '/api/embeddings', headers=headers, data=json.dumps({'model': model_name, 'prompt': text}),
+                    timeout=timeout, model_name=model_name
+                )
+                if response.status_code != 200:
+                    return [], self._error_message(response)
+                embeddings.append(response.json()['embedding'])
+            return embeddings, None
+        except requests.exceptions.RequestException as e:
+            return [], str(e)
+
+    def generate_response(self, model_name, user_input, timeout=None, options=None, use_cache=False):
+        bot_response, response_time, _, error_message, _ = self._post_generate(
+            model_name, user_input, timeout, options, use_cache
+        )
+        if error_message:
+            self.on_error(f"Error communicating with the model: {error_message}")
+        return bot_response, response_time
+
+    def stream_response(self, model_name, user_input, timeout=None, options=None, use_cache=False, messages=None):
+        return ResponseStream(self, model_name, user_input, timeout, options, use_cache, messages)
+
+    def generate_responses(self, model_names, user_input, max_workers=None, timeout=None, on_token=None,
+                           options=None, use_cache=False, messages=None):
+        # Fan the same prompt out to several models in parallel, each (model, prompt) pair runs once.
+        # When on_token is given responses are streamed and on_token(model_name, token) is called
+        # from the calling thread as tokens arrive. `messages` optionally maps a model name to the
+        # chat history to send it through /api/chat, ending with the new user message.
+        results = self.generate_results(model_names, user_input, max_workers, timeout, on_token, options, use_cache,
+                                        messages)
+        # Report errors from the calling thread, UI elements such as st.error can't be created in worker threads
+        responses = []
+        for model_name, (bot_response, response_time, ttft, error_message, metrics) in results.items():
+            if error_message:
+                self.on_error(f"Error communicating with {model_name}: {error_message}")
+            responses.append((model_name, bot_response, response_time, ttft, metrics))
+        return responses
+
+    def generate_results(self, model_names, user_input, max_workers=None, timeout=None, on_token=None,
+                         options=None, use_cache=False, messages=None, on_result=None):
+        # generate_responses without the error reporting, for callers that keep errors themselves.
+        # Returns {model_name: (bot_response, response_time, ttft, error_message, metrics)} in model order,
+        # on_result(model_name, result) is called from the calling thread as each model finishes.
+        messages = messages or {}
+        model_names = list(dict.fromkeys(model_names))
+        if not model_names:
+            return {}
+        max_workers = max(1, min(max_workers or self.max_workers, len(model_names)))
+        events = queue.Queue()
+        results = {}
+
+        def finish(future, model_name):
+            results[model_name] = future.result()
+            if on_result:
+                on_result(model_name, results[model_name])
+
+        with span('ollama.fan_out', models=model_names, stream=bool(on_token)), \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Models that don't fit in memory together run in consecutive groups instead of evicting each other
+            for group in self.residency.schedule(model_names):
+                if on_token:
+                    # Each worker runs in a copy of this context so its spans nest under the fan-out span
+                    futures = {
+                        executor.submit(
+                            contextvars.copy_context().run, self._consume_stream, model_name, user_input, timeout,
+                            options, use_cache, messages.get(model_name), events
+                        ): model_name
+                        for model_name in group
+                    }
+                    pending = set(futures)
+                    while pending or not events.empty():
+                        try:
+                            on_token(*events.get(timeout=0.05))
+                        except queue.Empty:
+                            pass
+                        # A finished worker has queued all of its tokens, so they are handled before its result
+                        for future in [future for future in pending if future.done()]:
+                            pending.discard(future)
+                            while not events.empty():
+                                on_token(*events.get())
+                            finish(future, futures[future])
+                else:
+                    futures = {
+                        executor.submit(
+                            contextvars.copy_context().run, self._post_generate, model_name, user_input, timeout,
+                            options, use_cache, messages.get(model_name)
+                        ): model_name
+                        for model_name in group
+                    }
+                    for future in as_completed(futures):
+                        finish(future, futures[future])
+        return {model_name: results[model_name] for model_name in model_names}
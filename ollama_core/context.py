@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+# Rough token count for trimming chat history, about four characters per token plus message overhead
+def estimate_tokens(text):
+    return len(text) // 4 + 4
+
+# Assembles /api/chat message lists from the saved history of each (session, model) pair and keeps them
+# in memory, so a new turn appends to the cached list instead of re-reading the session. History is trimmed
+# in steps (down to trim_ratio of the budget) rather than one turn at a time, which keeps the message prefix
+# identical across consecutive turns so Ollama can reuse its KV cache and only evaluate the new messages.
+# Turns saved since a history was cached, by this or any other process, are read by id before it is reused.
+class ChatContextManager:
+    def __init__(self, db_manager, token_budget=4096, trim_ratio=0.75, max_turns=200, max_cached=256,
+                 system_prompt=None):
+        self.db_manager = db_manager
+        self.token_budget = token_budget
+        self.trim_ratio = trim_ratio
+        self.max_turns = max_turns  # Most recent turns read from the database when a history is loaded
+        self.max_cached = max_cached
+        self.system_prompt = system_prompt
+        self._histories = OrderedDict()  # (session_id, model_name) -> [message, ...]
+        self._last_ids = {}  # (session_id, model_name) -> highest conversation id in the cached history
+        self._lock = threading.Lock()
+
+    def _trim(self, messages, reserved=0):
+        # Drop the oldest user/assistant pairs once the budget is exceeded
+        total = reserved + sum(estimate_tokens(message['content']) for message in messages)
+        if total <= self.token_budget:
+            return messages
+        target = self.token_budget * self.trim_ratio
+        while messages and total > target:
+            total -= sum(estimate_tokens(message['content']) for message in messages[:2])
+            del messages[:2]
+        return messages
+
+    def _history(self, session_id, model_name):
+        key = (session_id, model_name)
+        history = self._histories.get(key)
+        rows = self.db_manager.load_recent_turns(
+            session_id, model_name, self.max_turns, after=0 if history is None else self._last_ids[key]
+        )
+        if history is None or len(rows) == self.max_turns:
+            # Not cached yet, or so many new turns that the history is read afresh
+            history = self._histories[key] = []
+        for _, user_input, bot_response in reversed(rows):
+            history.append({'role': 'user', 'content': user_input})
+            history.append({'role': 'assistant', 'content': bot_response})
+        if rows:
+            self._last_ids[key] = max(self._last_ids.get(key, 0), max(row[0] for row in rows))
+            self._trim(history)
+        self._last_ids.setdefault(key, 0)
+        self._histories.move_to_end(key)
+        while len(self._histories) > self.max_cached:
+            del self._last_ids[self._histories.popitem(last=False)[0]]
+        return history
+
+    def build(self, session_id, model_name, user_input):
+        # Message list for the next turn: optional system prompt, trimmed history and the new user message
+        with self._lock:
+            reserved = estimate_tokens(user_input)
+            if self.system_prompt:
+                reserved += estimate_tokens(self.system_prompt)
+            history = self._trim(self._history(session_id, model_name), reserved)
+            messages = list(history)
+        if self.system_prompt:
+            messages.insert(0, {'role': 'system', 'content': self.system_prompt})
+        messages.append({'role': 'user', 'content': user_input})
+        return messages
+
+    def invalidate(self, session_id):
+        with self._lock:
+            for key in [key for key in self._histories if key[0] == session_id]:
+                del self._histories[key]
+                del self._last_ids[key]
@@ -0,0 +1,239 @@
+import os
+import threading
+
+import numpy as np
+
+DEFAULT_EMBEDDING_MODEL = os.environ.get('OLLAMA_EMBEDDING_MODEL', 'nomic-embed-text')
+# Characters of a prompt sent to the embedding model, longer prompts are cut to fit its context
+MAX_EMBED_CHARS = 4000
+
+# Semantic index over the prompts of saved turns. Vectors come from an Ollama embedding model, are
+# stored L2-normalised as float32 BLOBs next to the history and kept in memory as one matrix, so a
+# lookup is a single matrix-vector product. New turns are embedded in batches by a background thread
+# after notify(), which also backfills history saved before the index existed. Once started, the thread
+# also checks every poll_interval seconds for turns saved by other processes.
+class EmbeddingIndex:
+    def __init__(self, db_manager, client, model_name=DEFAULT_EMBEDDING_MODEL, batch_size=32, poll_interval=30):
+        self.db_manager = db_manager
+        self.client = client
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.error = None  # Last embedding error, cleared by the next successful batch
+        # Rows [:_size] of the arrays below are in use, the rest is room to append without copying
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._session_ids = np.empty(0, dtype=np.int64)
+        self._model_codes = np.empty(0, dtype=np.int32)  # Index into _model_names of the answering model
+        self._model_names = {}
+        self._matrix = None
+        self._loaded = False
+        self._cursor = 0  # Highest conversation id checked for a missing embedding
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        with db_manager.connection('embeddings') as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_embeddings (
+                    model_name TEXT,
+                    conversation_id INTEGER,
+                    vector BLOB,
+                    PRIMARY KEY (model_name, conversation_id)
+                )
+            ''')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS conversation_embeddings_delete AFTER DELETE ON conversations BEGIN
+                    DELETE FROM conversation_embeddings WHERE conversation_id = old.id;
+                END
+            ''')
+
+    def notify(self):
+        # Wakes the background worker to embed turns saved since the last batch, starting it if needed
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            while self.embed_pending():
+                pass
+
+    def embed_pending(self, limit=None):
+        # Embeds the next batch of turns that have no vector for this model yet, returns how many were
+        # embedded. Returns 0 on an embedding error, leaving the batch to be retried on the next call.
+        with self.db_manager.connection('embeddings') as conn:
+            rows = conn.execute('''
+                SELECT c.id, c.session_id, c.model_name, c.user_input
+                FROM conversations c
+                LEFT JOIN conversation_embeddings e ON e.model_name = ? AND e.conversation_id = c.id
+                WHERE c.id > ? AND e.conversation_id IS NULL
+                ORDER BY c.id
+                LIMIT ?
+            ''', (self.model_name, self._cursor, limit or self.batch_size)).fetchall()
+        if not rows:
+            return 0
+        # Several models answering the same prompt share one embedding
+        texts = list(dict.fromkeys((row[3] or '')[:MAX_EMBED_CHARS] for row in rows))
+        embeddings, error = self.client.embed(self.model_name, texts)
+        if error:
+            self.error = error
+            return 0
+        vectors = self._normalise(np.asarray(embeddings, dtype=np.float32))
+        by_text = dict(zip(texts, vectors))
+        vectors = np.stack([by_text[(row[3] or '')[:MAX_EMBED_CHARS]] for row in rows])
+        # Committed under the lock, otherwise a _load() in between would read the new vectors and they
+        # would be appended a second time
+        with self._lock:
+            with self.db_manager.connection('embeddings') as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO conversation_embeddings (model_name, conversation_id, vector) VALUES (?, ?, ?)',
+                    [(self.model_name, row[0], vector.tobytes()) for row, vector in zip(rows, vectors)]
+                )
+            if self._loaded:
+                self._append(rows, vectors)
+        self.error = None
+        self._cursor = rows[-1][0]
+        return len(rows)
+
+    def backfill(self):
+        # Embeds every turn without a vector in the calling thread, returns how many were embedded
+        total = 0
+        while True:
+            count = self.embed_pending()
+            if not count:
+                return total
+            total += count
+
+    @staticmethod
+    def _normalise(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def _append(self, rows, vectors):
+        # Adds (id, session_id, model_name, ...) rows and their vectors, doubling the arrays when full
+        count = len(rows)
+        if self._matrix is None:
+            self._matrix = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        if self._size + count > len(self._ids):
+            capacity = max(1024, 2 * (self._size + count))
+            self._ids = np.resize(self._ids[:self._size], capacity)
+            self._session_ids = np.resize(self._session_ids[:self._size], capacity)
+            self._model_codes = np.resize(self._model_codes[:self._size], capacity)
+            matrix = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        end = self._size + count
+        self._ids[self._size:end] = [row[0] for row in rows]
+        self._session_ids[self._size:end] = [row[1] or 0 for row in rows]
+        self._model_codes[self._size:end] = [
+            self._model_names.setdefault(row[2], len(self._model_names)) for row in rows
+        ]
+        self._matrix[self._size:end] = vectors
+        self._size = end
+
+    def _load(self):
+        # Reads all vectors of this model into memory, called under the lock on first search
+        with self.db_manager.connection('embeddings') as conn:
+            rows = conn.execute('''
+                SELECT e.conversation_id, c.session_id, c.model_name, e.vector
+                FROM conversation_embeddings e
+                JOIN conversations c ON c.id = e.conversation_id
+                WHERE e.model_name = ?
+                ORDER BY e.conversation_id
+            ''', (self.model_name,)).fetchall()
+        self._loaded = True
+        if rows:
+            self._append(rows, np.frombuffer(b''.join(row[3] for row in rows), dtype=np.float32).reshape(len(rows), -1))
+
+    def _snapshot(self):
+        # Views of the rows in use as (ids, session_ids, model_codes, matrix). Appends only write past
+        # the current size or into new arrays, so the views stay valid without holding the lock.
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            size = self._size
+            if not size:
+                return None
+            return self._ids[:size], self._session_ids[:size], self._model_codes[:size], self._matrix[:size]
+
+    def nearest(self, vector, limit=10, session_id=None, model_name=None, min_score=None):
+        # (conversation_id, score) pairs of the turns most similar to an embedding, best first. Scores
+        # are cosine similarities, model_name restricts the match to turns answered by that model.
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return []
+        ids, session_ids, model_codes, matrix = snapshot
+        vector = self._normalise(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        if vector.shape[0] != matrix.shape[1]:
+            return []  # Embedded with a different model
+        # Filters are applied first so a per-session lookup only scores that session's rows
+        if session_id is None and model_name is None:
+            candidates = np.arange(len(ids))
+            scores = matrix @ vector
+        else:
+            mask = np.ones(len(ids), dtype=bool)
+            if session_id is not None:
+                mask &= session_ids == session_id
+            if model_name is not None:
+                mask &= model_codes == self._model_names.get(model_name, -1)
+            candidates = np.flatnonzero(mask)
+            # Gathering a large share of the rows costs more than scoring them all
+            if len(candidates) > len(ids) // 4:
+                scores = (matrix @ vector)[candidates]
+            else:
+                scores = matrix[candidates] @ vector
+        if min_score is not None:
+            keep = scores >= min_score
+            candidates, scores = candidates[keep], scores[keep]
+        if len(scores) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores)
+        return [(int(ids[i]), float(score)) for i, score in zip(candidates[order], scores[order])]
+
+    def embed_query(self, text):
+        embeddings, error = self.client.embed(self.model_name, [text[:MAX_EMBED_CHARS]])
+        if error:
+            self.error = error
+            return None
+        return embeddings[0]
+
+    def search(self, query, session_id=None, limit=20, model_name=None, min_score=None):
+        # Semantic counterpart of DatabaseManager.search: (id, session_id, model_name, timestamp,
+        # user_input, bot_response, score) rows, most similar first. Empty when the query can't be embedded.
+        if not query.strip():
+            return []
+        vector = self.embed_query(query)
+        if vector is None:
+            return []
+        matches = self.nearest(vector, limit, session_id, model_name, min_score)
+        if not matches:
+            return []
+        scores = dict(matches)
+        with self.db_manager.connection('embeddings') as conn:
+            rows = conn.execute(f'''
+                SELECT id, session_id, model_name, timestamp, user_input, bot_response
+                FROM conversations WHERE id IN ({', '.join('?' * len(scores))})
+            ''', list(scores)).fetchall()
+        return sorted((row + (scores[row[0]],) for row in rows), key=lambda row: -row[-1])
+
+    def find_answered(self, prompt, model_name, min_score=0.95):
+        # The closest earlier turn of model_name to a new prompt, as (id, bot_response, score), or None.
+        # Lets a front-end offer a previous answer to an essentially identical question.
+        results = self.search(prompt, limit=1, model_name=model_name, min_score=min_score)
+        if not results:
+            return None
+        return results[0][0], results[0][5], results[0][6]
+
+    def stats(self):
+        with self.db_manager.connection('embeddings') as conn:
+            embedded = conn.execute(
+                'SELECT COUNT(*) FROM conversation_embeddings WHERE model_name = ?', (self.model_name,)
+            ).fetchone()[0]
+            total = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        return {'model': self.model_name, 'embedded': embedded, 'pending': total - embedded, 'error': self.error}
@@ -0,0 +1,82 @@
+import io
+import csv
+import json
+
+# Columns of the conversations table written by an export, followed by the session name
+EXPORT_COLUMNS = [
+    'id', 'session_id', 'model_name', 'timestamp', 'user_input', 'bot_response', 'response_time', 'ttft',
+    'prompt_eval_count', 'eval_count', 'total_duration', 'load_duration', 'prompt_eval_duration',
+    'eval_duration', 'options'
+]
+EXPORT_FIELDS = EXPORT_COLUMNS + ['session_name']
+EXPORT_MIME_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# Chunk writers for exports. Each wraps a binary file and writes one chunk of row tuples at a time,
+# close() finishes the output but leaves the file itself open for the caller.
+class CsvExportWriter:
+    def __init__(self, file):
+        self.file = io.TextIOWrapper(file, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EXPORT_FIELDS)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.detach()
+
+class JsonlExportWriter:
+    def __init__(self, file):
+        self.file = io.TextIOWrapper(file, encoding='utf-8', newline='\n')
+
+    def write_rows(self, rows):
+        options_index = EXPORT_FIELDS.index('options')
+        for row in rows:
+            record = dict(zip(EXPORT_FIELDS, row))
+            if row[options_index]:
+                record['options'] = json.loads(row[options_index])
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.file.detach()
+
+class ParquetExportWriter:
+    # Every chunk becomes one row group, so only a single chunk is held in memory
+    def __init__(self, file):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Parquet export requires pyarrow, install it with `pip install pyarrow`.')
+        self.pa = pa
+        self.schema = pa.schema([
+            ('id', pa.int64()), ('session_id', pa.int64()), ('model_name', pa.string()), ('timestamp', pa.string()),
+            ('user_input', pa.string()), ('bot_response', pa.string()), ('response_time', pa.float64()),
+            ('ttft', pa.float64()), ('prompt_eval_count', pa.int64()), ('eval_count', pa.int64()),
+            ('total_duration', pa.float64()), ('load_duration', pa.float64()),
+            ('prompt_eval_duration', pa.float64()), ('eval_duration', pa.float64()), ('options', pa.string()),
+            ('session_name', pa.string())
+        ])
+        self.writer = pq.ParquetWriter(file, self.schema)
+
+    def write_rows(self, rows):
+        columns = [self.pa.array(column, type=field.type) for column, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+EXPORT_WRITERS = {'csv': CsvExportWriter, 'jsonl': JsonlExportWriter, 'parquet': ParquetExportWriter}
+
+# Streams the conversations matching the filters (session_id, model_name, since, before) from an SQLite
+# cursor into a binary file chunk by chunk and returns the number of rows written
+def export_conversations(db_manager, file, fmt='csv', chunk_size=1000, **filters):
+    writer = EXPORT_WRITERS[fmt](file)
+    count = 0
+    try:
+        for rows in db_manager.iter_conversations(EXPORT_COLUMNS, chunk_size=chunk_size, **filters):
+            writer.write_rows(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,233 @@
+import os
+import gzip
+import json
+from datetime import datetime, timezone
+
+from .storage import CONVERSATION_INDEXES, METRIC_COLUMNS, SEARCH_TRIGGERS, content_hash
+
+# Conversation columns copied from a source, the session and row id are remapped on import
+IMPORT_COLUMNS = ['model_name', 'user_input', 'bot_response', 'timestamp'] + [
+    column for column in METRIC_COLUMNS if column != 'content_hash'
+]
+# Fields a record needs to be imported as a turn, records without them are skipped
+REQUIRED_COLUMNS = ('model_name', 'user_input', 'bot_response')
+# PRAGMA cache_size while importing, negative values are in KiB (256 MB)
+IMPORT_CACHE_SIZE = -256 * 1024
+
+# Timestamp in SQLite's CURRENT_TIMESTAMP format and in UTC, as every reader and the datetime('now', ...)
+# comparisons expect. Accepts ISO 8601 with a T separator, fractional seconds, Z or an offset. Raises
+# ValueError for anything else.
+def normalize_timestamp(value):
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid timestamp: {value!r}')
+    parsed = datetime.fromisoformat(value.strip())
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+# Merges other chat_history.db files or JSONL exports into a database. Rows are staged in a temporary
+# table, deduplicated by content hash against the target and each other, then copied over in one
+# transaction with the FTS triggers (and, for large imports, the secondary indexes) dropped until the end.
+# Sessions are matched by name: on_conflict='merge' adds to an existing session of the same name,
+# 'rename' creates a new one named "name (2)", "name (3)", ...
+class HistoryImporter:
+    def __init__(self, db_manager, on_conflict='merge', default_session='Imported', defer_indexes=None,
+                 chunk_size=10000):
+        self.db_manager = db_manager
+        self.on_conflict = on_conflict
+        self.default_session = default_session  # Session for rows that don't name one
+        self.defer_indexes = defer_indexes  # None decides from the import size
+        self.chunk_size = chunk_size
+
+    def import_sqlite(self, path):
+        # Returns (imported, duplicates, sessions_created, invalid)
+        if not os.path.isfile(path):
+            # ATTACH would create an empty database instead of failing
+            raise FileNotFoundError(path)
+        with self.db_manager.connection('import') as conn:
+            conn.execute('ATTACH DATABASE ? AS import_source', (path,))
+            try:
+                source_columns = {row[1] for row in conn.execute('PRAGMA import_source.table_info(conversations)')}
+                has_sessions = conn.execute(
+                    "SELECT 1 FROM import_source.sqlite_master WHERE type = 'table' AND name = 'session'"
+                ).fetchone()
+
+                def load(conn):
+                    # Columns missing from older databases are imported as NULL
+                    select = ', '.join(f'c.{column}' if column in source_columns else 'NULL' for column in IMPORT_COLUMNS)
+                    bot_response = 'c.bot_response'
+                    if 'compression' in source_columns:
+                        # Archive written by DatabaseMaintenance with large answers compressed
+                        from .maintenance import decompress_response
+
+                        conn.create_function('decompress_response', 2, decompress_response, deterministic=True)
+                        bot_response = 'decompress_response(c.bot_response, c.compression)'
+                        select = select.replace('c.bot_response', bot_response)
+                    conn.execute(f'''
+                        INSERT OR IGNORE INTO temp.import_staging
+                            (session_name, session_timestamp, {', '.join(IMPORT_COLUMNS)}, content_hash)
+                        SELECT {'s.name, s.timestamp' if has_sessions else 'NULL, NULL'}, {select},
+                            content_hash(c.model_name, c.timestamp, c.user_input, {bot_response})
+                        FROM import_source.conversations c
+                        {'LEFT JOIN import_source.session s ON s.id = c.session_id' if has_sessions else ''}
+                        WHERE {' AND '.join(f'c.{column} IS NOT NULL' for column in REQUIRED_COLUMNS)}
+                    ''')
+                    total, valid = conn.execute(f'''
+                        SELECT COUNT(*), COUNT(*) FILTER (
+                            WHERE {' AND '.join(f'{column} IS NOT NULL' for column in REQUIRED_COLUMNS)}
+                        )
+                        FROM import_source.conversations
+                    ''').fetchone()
+                    return valid, total - valid
+
+                return self._import(conn, load)
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute('DETACH DATABASE import_source')
+
+    def import_jsonl(self, path):
+        # Reads records in the format written by the exporter, gzip compressed when the name ends in .gz.
+        # Records missing a REQUIRED_COLUMNS field or with an unreadable timestamp are skipped.
+        # Returns (imported, duplicates, sessions_created, invalid)
+        def load(conn):
+            sql = f'''
+                INSERT OR IGNORE INTO temp.import_staging
+                    (session_name, session_timestamp, {', '.join(IMPORT_COLUMNS)}, content_hash)
+                VALUES ({', '.join('?' * (len(IMPORT_COLUMNS) + 3))})
+            '''
+            rows = []
+            count = invalid = 0
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if not isinstance(record, dict) or any(
+                        not isinstance(record.get(column), str) for column in REQUIRED_COLUMNS
+                    ):
+                        invalid += 1
+                        continue
+                    if record.get('timestamp') is not None:
+                        try:
+                            record['timestamp'] = normalize_timestamp(record['timestamp'])
+                        except ValueError:
+                            invalid += 1
+                            continue
+                    if isinstance(record.get('options'), dict):
+                        record['options'] = json.dumps(record['options'], sort_keys=True)
+                    rows.append(
+                        [record.get('session_name'), None] + [record.get(column) for column in IMPORT_COLUMNS] + [
+                            content_hash(record.get('model_name'), record.get('timestamp'), record.get('user_input'),
+                                         record.get('bot_response'))
+                        ]
+                    )
+                    count += 1
+                    if len(rows) >= self.chunk_size:
+                        conn.executemany(sql, rows)
+                        rows = []
+            conn.executemany(sql, rows)
+            conn.execute('UPDATE temp.import_staging SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL')
+            return count, invalid
+
+        with self.db_manager.connection('import') as conn:
+            return self._import(conn, load)
+
+    def _import(self, conn, load):
+        conn.create_function('content_hash', 4, content_hash, deterministic=True)
+        # A bigger page cache, for the staging table too, keeps index builds and dedup lookups in memory
+        cache_sizes = {schema: conn.execute(f'PRAGMA {schema}.cache_size').fetchone()[0] for schema in ('main', 'temp')}
+        for schema in cache_sizes:
+            conn.execute(f'PRAGMA {schema}.cache_size = {IMPORT_CACHE_SIZE}')
+        try:
+            return self._import_staged(conn, load)
+        finally:
+            for schema, cache_size in cache_sizes.items():
+                conn.execute(f'PRAGMA {schema}.cache_size = {cache_size}')
+
+    def _import_staged(self, conn, load):
+        conn.execute('BEGIN')
+        conn.execute('DROP TABLE IF EXISTS temp.import_staging')
+        # The unique hash drops duplicates within the import as rows are loaded, keeping the first
+        conn.execute(f'''
+            CREATE TEMP TABLE import_staging (
+                session_name TEXT, session_timestamp TEXT, {', '.join(IMPORT_COLUMNS)}, content_hash BLOB UNIQUE
+            )
+        ''')
+        staged, invalid = load(conn)
+
+        # The FTS index is filled in bulk at the end, which also keeps the hash backfill below
+        # from rewriting the index of every existing row
+        fts_enabled = self.db_manager.fts_enabled
+        if fts_enabled:
+            for name in SEARCH_TRIGGERS:
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        # Rows saved since the last import have no hash yet
+        conn.execute('''
+            UPDATE conversations SET content_hash = content_hash(model_name, timestamp, user_input, bot_response)
+            WHERE content_hash IS NULL
+        ''')
+
+        # Drop rows already in the target
+        conn.execute('''
+            DELETE FROM temp.import_staging WHERE content_hash IN (SELECT content_hash FROM main.conversations)
+        ''')
+        new_rows = conn.execute('SELECT COUNT(*) FROM temp.import_staging').fetchone()[0]
+
+        conn.execute('UPDATE temp.import_staging SET session_name = ? WHERE session_name IS NULL', (self.default_session,))
+        sessions_created = self._map_sessions(conn)
+
+        # Dedup is done, so every index can go. Rebuilding one costs about as much as the table
+        # is big, so indexes are only deferred when the import adds a sizeable share of rows
+        existing_rows = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        defer = self.defer_indexes if self.defer_indexes is not None else new_rows > existing_rows / 4
+        if defer and new_rows:
+            for name in CONVERSATION_INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM conversations').fetchone()[0]
+        conn.execute(f'''
+            INSERT INTO conversations (session_id, {', '.join(IMPORT_COLUMNS)}, content_hash)
+            SELECT m.session_id, {', '.join('s.' + column for column in IMPORT_COLUMNS)}, s.content_hash
+            FROM temp.import_staging s
+            JOIN temp.import_sessions m ON m.name = s.session_name
+            ORDER BY s.timestamp, s.rowid
+        ''')
+        self.db_manager.create_indexes(conn)
+        if fts_enabled:
+            conn.execute('''
+                INSERT INTO conversations_fts (rowid, user_input, bot_response)
+                SELECT id, user_input, bot_response FROM conversations WHERE id > ?
+            ''', (last_id,))
+            for trigger in SEARCH_TRIGGERS.values():
+                conn.execute(trigger)
+        conn.execute('DROP TABLE temp.import_staging')
+        conn.execute('DROP TABLE temp.import_sessions')
+        conn.commit()
+        return new_rows, staged - new_rows, sessions_created, invalid
+
+    def _map_sessions(self, conn):
+        # Fills temp.import_sessions with the target session id of every source session name that still
+        # has rows to import and returns how many sessions were created
+        conn.execute('DROP TABLE IF EXISTS temp.import_sessions')
+        conn.execute('CREATE TEMP TABLE import_sessions (name TEXT PRIMARY KEY, session_id INTEGER)')
+        created = 0
+        for name, session_timestamp in conn.execute('''
+            SELECT session_name, MIN(session_timestamp) FROM temp.import_staging GROUP BY session_name
+        ''').fetchall():
+            row = conn.execute('SELECT id FROM session WHERE name = ?', (name,)).fetchone()
+            if row and self.on_conflict == 'merge':
+                session_id = row[0]
+            else:
+                target_name = name
+                suffix = 2
+                while conn.execute('SELECT 1 FROM session WHERE name = ?', (target_name,)).fetchone():
+                    target_name = f'{name} ({suffix})'
+                    suffix += 1
+                session_id = conn.execute(
+                    'INSERT INTO session (name, timestamp) VALUES (?, COALESCE(?, CURRENT_TIMESTAMP))',
+                    (target_name, session_timestamp)
+                ).lastrowid
+                created += 1
+            conn.execute('INSERT INTO temp.import_sessions (name, session_id) VALUES (?, ?)', (name, session_id))
+        return created
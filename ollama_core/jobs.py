@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import socket
+import sys
+import threading
+
+from .telemetry import JOB_QUEUE_WAIT, JOBS
+
+DEFAULT_JOB_WORKERS = int(os.environ.get('OLLAMA_JOB_WORKERS', 2))
+ACTIVE_STATUSES = ('queued', 'running')
+# Jobs whose worker stopped heartbeating are requeued this many times before they are failed
+MAX_ATTEMPTS = 3
+
+# Wraps answers that look like code in a Python block, as the Streamlit app has always saved them
+def wrap_code(bot_response):
+    if 'def ' in bot_response or 'class ' in bot_response:
+        return f"```python\n{bot_response}\n```"
+    return bot_response
+
+# Persistent queue of generations in the chat history database. A job sends one prompt to one or more
+# models; worker threads in any process using the same database claim queued jobs, stream the partial
+# output of every model into job_outputs and save the finished turns to the conversations table in the
+# same transaction that marks the job done. Front-ends submit a job and poll it, so a generation
+# survives Streamlit reruns and closed browsers, and a job left behind by a stopped worker is requeued.
+class JobQueue:
+    def __init__(self, db_manager, client, workers=DEFAULT_JOB_WORKERS, poll_interval=1.0, flush_interval=0.5,
+                 stale_after=120, keep_finished=24 * 3600, on_done=None):
+        self.db_manager = db_manager
+        self.client = client
+        self.workers = workers
+        self.poll_interval = poll_interval  # Seconds between checks for jobs submitted by other processes
+        self.flush_interval = flush_interval  # Seconds between writes of the partial output
+        self.stale_after = stale_after  # Seconds without a heartbeat before a running job is requeued
+        self.keep_finished = keep_finished  # Seconds finished jobs are kept for polling, None keeps them
+        self.on_done = on_done  # on_done(job_id, rows) after a job's turns are saved, from the worker thread
+        self._threads = []
+        self._running = set()  # Ids of the jobs run by this process, kept alive by the heartbeat
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        with db_manager.connection('jobs') as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id INTEGER,
+                    prompt TEXT,
+                    models TEXT,
+                    settings TEXT,
+                    status TEXT DEFAULT 'queued',
+                    progress INTEGER DEFAULT 0,
+                    error TEXT,
+                    worker TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    created REAL,
+                    started REAL,
+                    finished REAL,
+                    heartbeat REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_outputs (
+                    job_id INTEGER,
+                    model_name TEXT,
+                    position INTEGER,
+                    output TEXT DEFAULT '',
+                    status TEXT DEFAULT 'queued',
+                    error TEXT,
+                    response_time REAL,
+                    ttft REAL,
+                    metrics TEXT,
+                    PRIMARY KEY (job_id, model_name)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session_id, id)')
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS jobs_delete AFTER DELETE ON jobs BEGIN
+                    DELETE FROM job_outputs WHERE job_id = old.id;
+                END
+            ''')
+            # A worker still running a job of a deleted session finds it gone and saves nothing
+            conn.execute('''
+                CREATE TRIGGER IF NOT EXISTS jobs_session_delete AFTER DELETE ON session BEGIN
+                    DELETE FROM jobs WHERE session_id = old.id;
+                END
+            ''')
+
+    def submit(self, session_id, prompt, models, options=None, use_cache=False, messages=None, wrap_code=False):
+        # Queues a prompt for the given models and returns the job id. `messages` maps a model name to
+        # its /api/chat history as for OllamaAPIClient.generate_responses, wrap_code applies wrap_code()
+        # to the saved answers.
+        models = list(dict.fromkeys(models))
+        settings = {'options': options, 'use_cache': use_cache, 'messages': messages, 'wrap_code': wrap_code}
+        with self.db_manager.connection('jobs') as conn:
+            job_id = conn.execute(
+                'INSERT INTO jobs (session_id, prompt, models, settings, created) VALUES (?, ?, ?, ?, ?)',
+                (session_id, prompt, json.dumps(models), json.dumps(settings), time.time())
+            ).lastrowid
+            conn.executemany(
+                'INSERT INTO job_outputs (job_id, model_name, position) VALUES (?, ?, ?)',
+                [(job_id, model_name, position) for position, model_name in enumerate(models)]
+            )
+        self._wake.set()
+        return job_id
+
+    def start(self):
+        # Starts the worker threads and the heartbeat thread, calling it again does nothing
+        with self._lock:
+            if self._threads:
+                return
+            prefix = f'{socket.gethostname()}:{os.getpid()}'
+            self._threads = [
+                threading.Thread(target=self._work, args=(f'{prefix}:{number}',), daemon=True)
+                for number in range(self.workers)
+            ]
+            self._threads.append(threading.Thread(target=self._maintain, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, worker):
+        while True:
+            try:
+                ran = self.run_next(worker)
+            except Exception as e:
+                print(f'Job worker {worker} failed: {e}', file=sys.stderr)
+                ran = None
+            if ran is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _maintain(self):
+        # Heartbeats the jobs this process runs, requeues jobs abandoned by stopped workers and purges old jobs
+        while True:
+            try:
+                self.heartbeat()
+                if self.recover():
+                    self._wake.set()
+                self.purge()
+            except Exception as e:
+                print(f'Job heartbeat failed: {e}', file=sys.stderr)
+            time.sleep(self.stale_after / 4)
+
+    def heartbeat(self):
+        # Marks the jobs this process runs as alive, so other processes don't requeue them
+        with self._lock:
+            running = list(self._running)
+        if running:
+            with self.db_manager.connection('jobs') as conn:
+                conn.execute(
+                    f"UPDATE jobs SET heartbeat = ? WHERE id IN ({', '.join('?' * len(running))})",
+                    [time.time()] + running
+                )
+
+    def keep_alive(self):
+        # Heartbeats in a background thread for run_next() calls made without start(). Returns an Event that
+        # stops the thread when set.
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.stale_after / 4):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    print(f'Job heartbeat failed: {e}', file=sys.stderr)
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def recover(self):
+        # Requeues running jobs without a recent heartbeat, or fails them after MAX_ATTEMPTS. Returns how many
+        # were requeued.
+        stale = time.time() - self.stale_after
+        with self.db_manager.connection('jobs') as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', finished = ?, error = 'The worker running this job stopped'
+                WHERE status = 'running' AND heartbeat < ? AND attempts >= ?
+            ''', (time.time(), stale, MAX_ATTEMPTS))
+            return conn.execute('''
+                UPDATE jobs SET status = 'queued', worker = NULL, progress = 0
+                WHERE status = 'running' AND heartbeat < ?
+            ''', (stale,)).rowcount
+
+    def purge(self):
+        if self.keep_finished is None:
+            return 0
+        with self.db_manager.connection('jobs') as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND finished < ?",
+                (time.time() - self.keep_finished,)
+            ).rowcount
+
+    def _claim(self, worker):
+        # Marks the oldest queued job as running for this worker. The update only succeeds while the job is
+        # still queued, so when workers race for a job exactly one of them gets it.
+        with self.db_manager.connection('jobs') as conn:
+            while True:
+                job = conn.execute('''
+                    SELECT id, session_id, prompt, models, settings, created FROM jobs
+                    WHERE status = 'queued' ORDER BY id LIMIT 1
+                ''').fetchone()
+                if job is None:
+                    return None
+                now = time.time()
+                if conn.execute('''
+                    UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ?, attempts = attempts + 1
+                    WHERE id = ? AND status = 'queued'
+                ''', (worker, now, now, job[0])).rowcount:
+                    break
+            # A requeued job starts over
+            conn.execute(
+                "UPDATE job_outputs SET output = '', status = 'running', error = NULL WHERE job_id = ?", (job[0],)
+            )
+        JOB_QUEUE_WAIT.observe(now - job[5])
+        return job
+
+    def run_next(self, worker):
+        # Claims and runs the next queued job in the calling thread, returns its id or None when the queue is empty
+        job = self._claim(worker)
+        if job is None:
+            return None
+        job_id = job[0]
+        with self._lock:
+            self._running.add(job_id)
+        try:
+            self._run(worker, *job[:5])
+        except Exception as e:
+            self._finish(worker, job_id, 'failed', str(e), [])
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+        return job_id
+
+    def _run(self, worker, job_id, session_id, prompt, models, settings):
+        models = json.loads(models)
+        settings = json.loads(settings)
+        partial = dict.fromkeys(models, '')
+        changed = set()
+        last_flush = [time.perf_counter()]
+
+        def flush():
+            with self.db_manager.connection('jobs') as conn:
+                conn.executemany(
+                    'UPDATE job_outputs SET output = ? WHERE job_id = ? AND model_name = ?',
+                    [(partial[model_name], job_id, model_name) for model_name in changed]
+                )
+            changed.clear()
+            last_flush[0] = time.perf_counter()
+
+        def on_token(model_name, token):
+            partial[model_name] += token
+            changed.add(model_name)
+            if time.perf_counter() - last_flush[0] >= self.flush_interval:
+                flush()
+
+        def on_result(model_name, result):
+            bot_response, response_time, ttft, error_message, metrics = result
+            changed.discard(model_name)
+            with self.db_manager.connection('jobs') as conn:
+                conn.execute('''
+                    UPDATE job_outputs SET output = ?, status = ?, error = ?, response_time = ?, ttft = ?, metrics = ?
+                    WHERE job_id = ? AND model_name = ?
+                ''', (
+                    bot_response, 'failed' if error_message else 'done', error_message, response_time, ttft,
+                    json.dumps(metrics), job_id, model_name
+                ))
+                conn.execute('UPDATE jobs SET progress = progress + 1 WHERE id = ?', (job_id,))
+
+        results = self.client.generate_results(
+            models, prompt, on_token=on_token, options=settings['options'], use_cache=settings['use_cache'],
+            messages=settings['messages'], on_result=on_result
+        )
+        rows = []
+        errors = []
+        for model_name, (bot_response, response_time, ttft, error_message, metrics) in results.items():
+            if error_message:
+                errors.append(f'{model_name}: {error_message}')
+            if bot_response:
+                if settings['wrap_code']:
+                    bot_response = wrap_code(bot_response)
+                rows.append(
+                    (session_id, model_name, prompt, bot_response, response_time, ttft, metrics, settings['options'])
+                )
+        # A job is done when at least one model answered, per-model errors stay in job_outputs
+        self._finish(worker, job_id, 'done' if rows else 'failed', '; '.join(errors) or None, rows)
+
+    def _finish(self, worker, job_id, status, error, rows):
+        with self.db_manager.connection('jobs') as conn:
+            owned = conn.execute('''
+                UPDATE jobs SET status = ?, error = ?, finished = ?
+                WHERE id = ? AND worker = ? AND status = 'running'
+            ''', (status, error, time.time(), job_id, worker)).rowcount
+            # Nothing is saved when the job was deleted or requeued to another worker meanwhile
+            if owned:
+                self.db_manager.insert_conversations(conn, rows)
+        if owned:
+            JOBS.inc(status=status)
+            if self.on_done and rows:
+                self.on_done(job_id, rows)
+
+    def get(self, job_id):
+        jobs = self._load('WHERE id = ?', (job_id,))
+        return jobs[0] if jobs else None
+
+    def jobs(self, session_id=None, active=False, limit=20):
+        # Most recent jobs first, optionally only those of a session or those still queued or running
+        conditions = []
+        params = []
+        if session_id is not None:
+            conditions.append('session_id = ?')
+            params.append(session_id)
+        if active:
+            conditions.append(f"status IN ({', '.join('?' * len(ACTIVE_STATUSES))})")
+            params.extend(ACTIVE_STATUSES)
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        return self._load(f'{where} ORDER BY id DESC LIMIT ?', params + [limit])
+
+    def _load(self, clause, params):
+        # Job dicts with the partial or final output of each model under 'outputs', in submission order
+        with self.db_manager.connection('jobs') as conn:
+            rows = conn.execute(f'''
+                SELECT id, session_id, prompt, models, status, progress, error, created, started, finished
+                FROM jobs {clause}
+            ''', params).fetchall()
+            jobs = []
+            for job_id, session_id, prompt, models, status, progress, error, created, started, finished in rows:
+                outputs = {}
+                for model_name, output, output_status, output_error, response_time, ttft, metrics in conn.execute('''
+                    SELECT model_name, output, status, error, response_time, ttft, metrics
+                    FROM job_outputs WHERE job_id = ? ORDER BY position
+                ''', (job_id,)):
+                    outputs[model_name] = {
+                        'output': output,
+                        'status': output_status,
+                        'error': output_error,
+                        'response_time': response_time,
+                        'ttft': ttft,
+                        'metrics': json.loads(metrics) if metrics else {}
+                    }
+                jobs.append({
+                    'id': job_id,
+                    'session_id': session_id,
+                    'prompt': prompt,
+                    'models': json.loads(models),
+                    'status': status,
+                    'progress': progress,
+                    'error': error,
+                    'created': created,
+                    'started': started,
+                    'finished': finished,
+                    'outputs': outputs
+                })
+        return jobs
+
+    def stats(self):
+        with self.db_manager.connection('jobs') as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
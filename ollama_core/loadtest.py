@@ -0,0 +1,121 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import percentile
+
+LOAD_PERCENTILES = (50, 90, 99)
+
+# Open-loop load generator for OllamaAPIClient. Requests start on a fixed schedule at the target rate
+# whether or not earlier ones have finished, so an overloaded server shows up as growing latency rather
+# than as a quietly lower request rate. Latency is measured from the scheduled start, which also counts
+# the time a request waited for a free slot (no coordinated omission).
+class LoadGenerator:
+    def __init__(self, client, models, prompts, qps=5, duration=30, stream=True, chat=False, arrivals='constant',
+                 max_in_flight=64, options=None, seed=None):
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.prompts = prompts
+        self.qps = qps
+        self.duration = duration  # Seconds during which requests are started
+        self.stream = stream
+        self.chat = chat  # Send the prompts through /api/chat instead of /api/generate
+        self.arrivals = arrivals  # 'constant' spacing or 'poisson' arrivals averaging qps
+        self.max_in_flight = max_in_flight
+        self.options = options
+        self._random = random.Random(seed)
+
+    def schedule(self):
+        # Start offsets in seconds from the beginning of the run
+        offsets = []
+        offset = 0.0
+        while offset < self.duration:
+            offsets.append(offset)
+            offset += self._random.expovariate(self.qps) if self.arrivals == 'poisson' else 1 / self.qps
+        return offsets
+
+    def _sample(self, model_name, prompt, scheduled):
+        started = time.perf_counter()
+        messages = [{'role': 'user', 'content': prompt}] if self.chat else None
+        if self.stream:
+            stream = self.client.stream_response(model_name, prompt, options=self.options, messages=messages)
+            for _ in stream:
+                pass
+            response_time, ttft, error_message, metrics = stream.response_time, stream.ttft, stream.error, stream.metrics
+        else:
+            _, response_time, ttft, error_message, metrics = self.client._post_generate(
+                model_name, prompt, options=self.options, messages=messages
+            )
+        finished = time.perf_counter()
+        return {
+            'model': model_name,
+            'scheduled': scheduled,
+            'start_delay': started - scheduled,  # Time spent waiting for a free slot
+            'latency': finished - scheduled,
+            'response_time': response_time,
+            'ttft': ttft + (started - scheduled) if ttft is not None else None,
+            'eval_count': metrics.get('eval_count'),
+            'error': error_message
+        }
+
+    def run(self, progress=None):
+        # Returns (samples, elapsed seconds from the first scheduled start to the last finished request)
+        samples = []
+        lock = threading.Lock()
+
+        def run_one(model_name, prompt, scheduled):
+            sample = self._sample(model_name, prompt, scheduled)
+            with lock:
+                samples.append(sample)
+            if progress:
+                progress(sample)
+
+        offsets = self.schedule()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='loadtest') as executor:
+            start = time.perf_counter()
+            for i, offset in enumerate(offsets):
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(
+                    run_one, self.models[i % len(self.models)], self.prompts[i % len(self.prompts)], start + offset
+                )
+        return samples, time.perf_counter() - start
+
+    @staticmethod
+    def _distribution(values):
+        stats = {f'p{p}': percentile(values, p) for p in LOAD_PERCENTILES}
+        stats['max'] = max(values) if values else None
+        return stats
+
+    def summarize(self, samples, elapsed):
+        # Overall and per-model throughput, error counts and latency/TTFT percentiles
+        def stats(model_samples):
+            ok = [sample for sample in model_samples if not sample['error']]
+            tokens = sum(sample['eval_count'] or 0 for sample in ok)
+            return {
+                'requests': len(model_samples),
+                'errors': len(model_samples) - len(ok),
+                'qps': len(ok) / elapsed if elapsed else None,
+                'tokens_per_second': tokens / elapsed if elapsed else None,
+                'latency': self._distribution([sample['latency'] for sample in ok]),
+                'ttft': self._distribution([sample['ttft'] for sample in ok if sample['ttft'] is not None]),
+                'start_delay': self._distribution([sample['start_delay'] for sample in model_samples])
+            }
+
+        errors = {}
+        for sample in samples:
+            if sample['error']:
+                errors[sample['error']] = errors.get(sample['error'], 0) + 1
+        return {
+            'target_qps': self.qps,
+            'elapsed': elapsed,
+            'max_retries': self.client.max_retries,  # 0 when every failed request counts as an error
+            'total': stats(samples),
+            'models': {
+                model_name: stats([sample for sample in samples if sample['model'] == model_name])
+                for model_name in self.models
+            },
+            'errors': errors
+        }
@@ -0,0 +1,367 @@
+import os
+import sys
+import gzip
+import time
+import zlib
+import threading
+
+from .export import EXPORT_COLUMNS, JsonlExportWriter
+from .importer import IMPORT_COLUMNS
+from .jobs import ACTIVE_STATUSES
+from .telemetry import DB_MAINTENANCE
+
+DEFAULT_RETENTION_DAYS = float(os.environ['OLLAMA_RETENTION_DAYS']) if os.environ.get('OLLAMA_RETENTION_DAYS') else None
+DEFAULT_MAX_DB_MB = float(os.environ['OLLAMA_MAX_DB_MB']) if os.environ.get('OLLAMA_MAX_DB_MB') else None
+# Seconds between runs of the background maintenance task
+DEFAULT_MAINTENANCE_INTERVAL = float(os.environ.get('OLLAMA_MAINTENANCE_INTERVAL', 3600))
+ARCHIVE_COMPRESSIONS = ('zlib', 'zstd', 'none')
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('zstd compression requires zstandard, install it with `pip install zstandard`.')
+    return zstandard
+
+def compress_response(text, codec):
+    # bot_response as stored in a cold archive database with the given codec
+    data = text.encode('utf-8')
+    if codec == 'zstd':
+        return _zstd().ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+def decompress_response(value, codec):
+    # Reverses compress_response, values stored uncompressed (codec NULL) are returned as they are
+    if not codec or value is None:
+        return value
+    if codec == 'zstd':
+        return _zstd().ZstdDecompressor().decompress(value).decode('utf-8')
+    return zlib.decompress(value).decode('utf-8')
+
+def default_archive_path(db_name):
+    return os.path.splitext(db_name)[0] + '.archive.db'
+
+# Keeps chat_history.db from growing without bound. Sessions last active more than max_age_days ago, then
+# the oldest sessions while the live data is over max_bytes, are copied to an archive and deleted with their
+# conversations, search index entries, embeddings and jobs. The archive is a cold SQLite database whose large
+# answers are zlib or zstd compressed, or gzip compressed JSONL in the export format (archive_path ending in
+# .jsonl.gz); both can be brought back with the import command. Orphan rows are then removed, free pages
+# returned to the file system by incremental vacuum and the query planner statistics refreshed.
+# Every step runs in short transactions, so the apps keep reading and writing while it runs.
+class DatabaseMaintenance:
+    def __init__(self, db_manager, max_age_days=DEFAULT_RETENTION_DAYS, max_bytes=None, archive_path='',
+                 compression='zlib', compress_min_bytes=1024, chunk_size=500, vacuum_pages=256, pause=0.05):
+        self.db_manager = db_manager
+        self.max_age_days = max_age_days  # None keeps sessions regardless of age
+        if max_bytes is None and DEFAULT_MAX_DB_MB is not None:
+            max_bytes = int(DEFAULT_MAX_DB_MB * 1024 * 1024)
+        self.max_bytes = max_bytes  # None puts no limit on the size of the live data
+        if archive_path == '':
+            archive_path = os.environ.get('OLLAMA_ARCHIVE_PATH') or default_archive_path(db_manager.db_name)
+        self.archive_path = None if archive_path == 'none' else archive_path  # None deletes without archiving
+        if compression not in ARCHIVE_COMPRESSIONS:
+            raise ValueError(f'Unsupported compression: {compression}')
+        if compression == 'zstd':
+            _zstd()
+        self.compression = compression  # Codec of answers in a cold archive database
+        self.compress_min_bytes = compress_min_bytes  # Shorter answers are archived uncompressed
+        self.chunk_size = chunk_size  # Rows deleted per transaction
+        self.vacuum_pages = vacuum_pages  # Pages freed per incremental vacuum step
+        self.pause = pause  # Seconds between write transactions, for the apps to get the lock in between
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, interval=DEFAULT_MAINTENANCE_INTERVAL, delay=60):
+        # Runs maintenance every `interval` seconds from a daemon thread, the first time after `delay` seconds
+        # so it doesn't compete with startup. Calling it again does nothing.
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(interval, delay), daemon=True)
+        self._thread.start()
+
+    def _run(self, interval, delay):
+        time.sleep(delay)
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                print(f'Database maintenance failed: {e}', file=sys.stderr)
+            time.sleep(interval)
+
+    def run(self, dry_run=False):
+        # One pass of every step. Returns a report of what was (or, with dry_run, would be) removed.
+        start_time = time.time()
+        before = self.stats()
+        sessions = self.expired_sessions()
+        report = {
+            'sessions': len(sessions),
+            'conversations': sum(session[2] for session in sessions),
+            'archive': self.archive_path if sessions else None,
+            'orphans': {},
+            'pages_freed': 0,
+            'size_before': before['size'],
+            'size_after': before['size']
+        }
+        if dry_run:
+            report['session_names'] = [session[1] for session in sessions]
+            report['elapsed'] = time.time() - start_time
+            return report
+        if sessions:
+            session_ids = [session[0] for session in sessions]
+            if self.archive_path:
+                self.archive(session_ids)
+            self.delete_sessions(session_ids)
+        report['orphans'] = self.cleanup_orphans()
+        report['pages_freed'] = self.incremental_vacuum()
+        self.analyze()
+        self.checkpoint()
+        report['size_after'] = self.stats()['size']
+        report['elapsed'] = time.time() - start_time
+        return report
+
+    def _tables(self, conn):
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def expired_sessions(self):
+        # (id, name, conversations) of the sessions to archive, least recently active first. Sessions with
+        # queued or running jobs are kept, and the size limit never removes the most recently active one.
+        if self.max_age_days is None and self.max_bytes is None:
+            return []
+        with self.db_manager.connection('maintenance') as conn:
+            active_jobs = ''
+            if 'jobs' in self._tables(conn):
+                active_jobs = f'''
+                    WHERE s.id NOT IN (
+                        SELECT session_id FROM jobs
+                        WHERE session_id IS NOT NULL AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})
+                    )
+                '''
+            # The per-session MAX and COUNT come from the (session_id, timestamp) index alone
+            sessions = conn.execute(f'''
+                SELECT s.id, s.name, COUNT(c.id), COALESCE(MAX(c.timestamp), s.timestamp) AS last_active,
+                       COALESCE(MAX(c.timestamp), s.timestamp) < datetime('now', ?)
+                FROM session s
+                LEFT JOIN conversations c ON c.session_id = s.id
+                {active_jobs}
+                GROUP BY s.id
+                ORDER BY last_active, s.id
+            ''', [f'-{self.max_age_days or 0} days'] + (list(ACTIVE_STATUSES) if active_jobs else [])).fetchall()
+            expired = [session[:3] for session in sessions if self.max_age_days is not None and session[4]]
+            excess = 0
+            if self.max_bytes is not None:
+                page_size, page_count, freelist = (
+                    conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+                    for pragma in ('page_size', 'page_count', 'freelist_count')
+                )
+                excess = (page_count - freelist) * page_size - self.max_bytes
+            if excess <= 0:
+                return expired
+            # The text of each session stands in for its share of the pages, scaled up so that the
+            # overhead of indexes, the search index and embeddings is freed along with it
+            sizes = dict(conn.execute('''
+                SELECT session_id, SUM(COALESCE(length(CAST(user_input AS BLOB)), 0)
+                                       + COALESCE(length(CAST(bot_response AS BLOB)), 0))
+                FROM conversations
+                GROUP BY session_id
+            ''').fetchall())
+        total = sum(size for size in sizes.values() if size) or 1
+        scale = (page_count - freelist) * page_size / total
+        freed = sum(sizes.get(session[0]) or 0 for session in expired) * scale
+        chosen = {session[0] for session in expired}
+        for session in sessions[:-1]:
+            if freed >= excess:
+                break
+            if session[0] not in chosen:
+                expired.append(session[:3])
+                freed += (sizes.get(session[0]) or 0) * scale
+        return expired
+
+    def archive(self, session_ids):
+        # Copies the sessions and their conversations to the archive. Archiving the same session twice does
+        # no harm (the cold database ignores rows it has, the importer skips duplicate JSONL lines), so a run
+        # interrupted before the delete simply archives them again.
+        if self.archive_path.endswith(('.jsonl.gz', '.json.gz')):
+            self._archive_jsonl(session_ids)
+        else:
+            self._archive_sqlite(session_ids)
+
+    def _archive_jsonl(self, session_ids):
+        with open(self.archive_path, 'ab') as raw:
+            # Every run appends a gzip member, gzip readers read them back as one stream
+            with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                writer = JsonlExportWriter(f)
+                for session_id in session_ids:
+                    for rows in self.db_manager.iter_conversations(EXPORT_COLUMNS, session_id=session_id,
+                                                                   chunk_size=self.chunk_size):
+                        writer.write_rows(rows)
+                writer.close()
+            raw.flush()
+            # On disk before the rows are deleted
+            os.fsync(raw.fileno())
+
+    def _archive_sqlite(self, session_ids):
+        columns = ', '.join(IMPORT_COLUMNS)
+        with self.db_manager.connection('maintenance') as conn:
+            conn.execute('ATTACH DATABASE ? AS archive', (self.archive_path,))
+            try:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS archive.session (
+                        id INTEGER PRIMARY KEY,
+                        name TEXT,
+                        timestamp DATETIME,
+                        archived DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Same columns as conversations, with the codec of bot_response in compression (NULL when
+                # it is stored as text), which the importer decompresses
+                conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS archive.conversations (
+                        id INTEGER PRIMARY KEY,
+                        session_id INTEGER,
+                        {columns},
+                        compression TEXT
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_conversations_session ON conversations (session_id)')
+                conn.commit()
+                select = ', '.join(f'c.{column}' for column in IMPORT_COLUMNS)
+                compression = 'NULL'
+                params = ()
+                if self.compression != 'none':
+                    codec = self.compression
+                    conn.create_function('compress_response', 1, lambda text: compress_response(text, codec),
+                                         deterministic=True)
+                    large = 'length(CAST(c.bot_response AS BLOB)) >= ?'
+                    select = select.replace(
+                        'c.bot_response', f'CASE WHEN {large} THEN compress_response(c.bot_response) ELSE c.bot_response END'
+                    )
+                    compression = f'CASE WHEN {large} THEN ? END'
+                    params = (self.compress_min_bytes, self.compress_min_bytes, codec)
+                for session_id in session_ids:
+                    conn.execute('''
+                        INSERT OR IGNORE INTO archive.session (id, name, timestamp)
+                        SELECT id, name, timestamp FROM session WHERE id = ?
+                    ''', (session_id,))
+                    conn.execute(f'''
+                        INSERT OR IGNORE INTO archive.conversations (id, session_id, {columns}, compression)
+                        SELECT c.id, c.session_id, {select}, {compression}
+                        FROM conversations c
+                        WHERE c.session_id = ?
+                    ''', params + (session_id,))
+                    conn.commit()
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute('DETACH DATABASE archive')
+
+    def delete_sessions(self, session_ids):
+        # Deletes the conversations in chunks so no single transaction holds the write lock for long, then
+        # the sessions, whose jobs go with them through a trigger
+        for session_id in session_ids:
+            while True:
+                with self.db_manager.connection('maintenance') as conn:
+                    deleted = conn.execute('''
+                        DELETE FROM conversations WHERE id IN (
+                            SELECT id FROM conversations WHERE session_id = ? LIMIT ?
+                        )
+                    ''', (session_id, self.chunk_size)).rowcount
+                DB_MAINTENANCE.inc(deleted, kind='conversations')
+                time.sleep(self.pause)
+                if deleted < self.chunk_size:
+                    break
+            self.db_manager.delete_session(session_id)
+            DB_MAINTENANCE.inc(kind='sessions')
+
+    def cleanup_orphans(self):
+        # Removes rows pointing at a session, conversation or job that no longer exists, left behind by
+        # databases without ON DELETE CASCADE or the triggers. Returns {table: rows deleted}.
+        checks = {
+            'conversations': 'session_id IS NOT NULL AND session_id NOT IN (SELECT id FROM session)',
+            'conversation_embeddings': 'conversation_id NOT IN (SELECT id FROM conversations)',
+            'jobs': 'session_id IS NOT NULL AND session_id NOT IN (SELECT id FROM session)',
+            'job_outputs': 'job_id NOT IN (SELECT id FROM jobs)'
+        }
+        with self.db_manager.connection('maintenance') as conn:
+            tables = self._tables(conn)
+        removed = {}
+        for table, condition in checks.items():
+            if table not in tables:
+                continue
+            count = 0
+            while True:
+                with self.db_manager.connection('maintenance') as conn:
+                    deleted = conn.execute(f'''
+                        DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)
+                    ''', (self.chunk_size,)).rowcount
+                count += deleted
+                if deleted < self.chunk_size:
+                    break
+                time.sleep(self.pause)
+            if count:
+                removed[table] = count
+                DB_MAINTENANCE.inc(count, kind='orphans')
+        return removed
+
+    def incremental_vacuum(self):
+        # Returns free pages to the file system vacuum_pages at a time and the number of pages freed. Does
+        # nothing until the database uses auto_vacuum=INCREMENTAL, see vacuum().
+        freed = 0
+        while True:
+            with self.db_manager.connection('maintenance') as conn:
+                if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    return freed
+                before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not before:
+                    break
+                # Run as a script, conn.execute() only steps the pragma once and frees a single page
+                conn.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+                after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            freed += before - after
+            if after >= before:
+                break
+            time.sleep(self.pause)
+        DB_MAINTENANCE.inc(freed, kind='pages')
+        return freed
+
+    def analyze(self):
+        # Refreshes the statistics the query planner picks indexes by, sampling at most ~1000 rows per index
+        with self.db_manager.connection('maintenance') as conn:
+            conn.execute('PRAGMA analysis_limit=1000')
+            try:
+                conn.execute('ANALYZE')
+            finally:
+                conn.execute('PRAGMA analysis_limit=0')
+
+    def checkpoint(self):
+        # Copies the WAL back into the database without waiting for readers
+        with self.db_manager.connection('maintenance') as conn:
+            conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def vacuum(self):
+        # Rewrites the whole database, switching it to auto_vacuum=INCREMENTAL, then truncates the WAL.
+        # Blocks every writer while it runs, so it is left to the maintain command.
+        with self.db_manager.connection('maintenance') as conn:
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def stats(self):
+        with self.db_manager.connection('maintenance') as conn:
+            page_size, page_count, freelist, auto_vacuum = (
+                conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum')
+            )
+            sessions = conn.execute('SELECT COUNT(*) FROM session').fetchone()[0]
+            conversations = conn.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        wal = self.db_manager.db_name + '-wal'
+        return {
+            'size': page_count * page_size,
+            'used': (page_count - freelist) * page_size,
+            'free': freelist * page_size,
+            'wal': os.path.getsize(wal) if os.path.exists(wal) else 0,
+            'auto_vacuum': ('none', 'full', 'incremental')[auto_vacuum],
+            'sessions': sessions,
+            'conversations': conversations
+        }
+
@@ -0,0 +1,28 @@
+# Convert the timing fields of a final /api/generate chunk to seconds, Ollama reports nanoseconds
+def extract_metrics(result):
+    metrics = {
+        'prompt_eval_count': result.get('prompt_eval_count'),
+        'eval_count': result.get('eval_count')
+    }
+    for field in ('total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration'):
+        metrics[field] = result[field] / 1e9 if result.get(field) is not None else None
+    if metrics['eval_count'] and metrics['eval_duration']:
+        metrics['tokens_per_second'] = metrics['eval_count'] / metrics['eval_duration']
+    else:
+        metrics['tokens_per_second'] = None
+    return metrics
+
+LATENCY_METRICS = ('response_time', 'ttft', 'total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration')
+
+# Linear interpolation between closest ranks, matching numpy's default percentile
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+def format_seconds(value):
+    return f'{value * 1000:.1f}ms' if value is not None else '-'
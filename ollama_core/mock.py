@@ -0,0 +1,347 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Samplers of the latency distributions, name -> (parameter count, sampler(rng, *parameters))
+DISTRIBUTIONS = {
+    'fixed': (1, lambda rng, value: value),
+    'uniform': (2, lambda rng, low, high: rng.uniform(low, high)),
+    'normal': (2, lambda rng, mean, stddev: rng.gauss(mean, stddev)),
+    'lognormal': (2, lambda rng, median, sigma: median * math.exp(rng.gauss(0, sigma))),
+    'exponential': (1, lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0.0)
+}
+
+# Turns a number of seconds, a spec such as 'uniform:0.01,0.2', 'normal:0.1,0.02', 'lognormal:0.1,0.5'
+# (median, sigma) or 'exponential:0.1' (mean), or a callable taking a random.Random into a sampler.
+# Samples below zero count as zero.
+def parse_distribution(spec):
+    if spec is None or callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        kind, parameters = 'fixed', [float(spec)]
+    else:
+        kind, _, arguments = str(spec).partition(':')
+        if not arguments:
+            kind, arguments = 'fixed', kind
+        try:
+            parameters = [float(argument) for argument in arguments.split(',')]
+        except ValueError:
+            raise ValueError(f'Invalid distribution {spec!r}, expected seconds or name:parameters') from None
+    if kind not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution {kind!r}, expected one of {', '.join(DISTRIBUTIONS)}")
+    count, sampler = DISTRIBUTIONS[kind]
+    if len(parameters) != count:
+        raise ValueError(f'The {kind} distribution takes {count} parameters, got {spec!r}')
+    return lambda rng: max(0.0, sampler(rng, *parameters))
+
+# Seconds a model stays loaded for an Ollama keep_alive value: a number of seconds or a duration such
+# as '5m' or '1h30m', negative keeps it loaded forever and 0 unloads it after the request
+def parse_keep_alive(keep_alive, default):
+    if keep_alive is None:
+        return default
+    if isinstance(keep_alive, (int, float)):
+        return float(keep_alive)
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    parts = re.findall(r'(-?[\d.]+)(ms|h|m|s)?', keep_alive)
+    if not parts:
+        return default
+    return sum(float(value) * units[unit or 's'] for value, unit in parts)
+
+# Stand-in for an Ollama server with deterministic or randomised timings, for benchmarks, load tests and
+# integration tests without a GPU. Implements /api/tags, /api/ps, /api/version, /api/generate and
+# /api/chat (streamed or not), /api/embed and /api/embeddings.
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, text, status=200):
+        # Ollama answers unknown routes with a plain-text 404
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload):
+        body = (json.dumps(payload) + '\n').encode('utf-8')
+        self.wfile.write(f'{len(body):x}\r\n'.encode('ascii') + body + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        mock = self.server.mock
+        mock.count(self.path)
+        if self.path == '/':
+            self._send_text('Ollama is running')
+        elif self.path == '/api/version':
+            self._send_json({'version': '0.0.0-mock'})
+        elif self.path == '/api/tags':
+            self._send_json({'models': [mock.describe(name) for name in mock.models + mock.embedding_models]})
+        elif self.path == '/api/ps':
+            self._send_json({'models': [
+                dict(mock.describe(name), size_vram=mock.model_size(name), expires_at=expires_at)
+                for name, expires_at in mock.loaded_models()
+            ]})
+        else:
+            self._send_text('404 page not found', 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        mock = self.server.mock
+        mock.count(self.path)
+        handlers = {'/api/generate': self._generate, '/api/chat': self._generate, '/api/embeddings': self._embed}
+        if not mock.legacy_embeddings:
+            handlers['/api/embed'] = self._embed
+        handler = handlers.get(self.path)
+        if handler is None:
+            self._send_text('404 page not found', 404)
+            return
+        model_name = request.get('model')
+        if model_name not in mock.models + mock.embedding_models:
+            self._send_json({'error': f"model '{model_name}' not found"}, 404)
+            return
+        time.sleep(mock.sample(mock.latency))
+        if mock.chance(mock.error_rate):
+            mock.count('error')
+            self._send_json({'error': 'injected error'}, mock.error_status)
+            return
+        handler(request, model_name)
+
+    def _generate(self, request, model_name):
+        mock = self.server.mock
+        chat = self.path == '/api/chat'
+        if model_name in mock.embedding_models:
+            self._send_json({'error': f'"{model_name}" does not support {"chat" if chat else "generate"}'}, 400)
+            return
+        start = time.perf_counter()
+        load_duration = mock.load(model_name, request.get('keep_alive'))
+        if chat:
+            prompt = ' '.join(message.get('content', '') for message in request.get('messages') or [])
+        else:
+            prompt = request.get('prompt', '')
+
+        def chunk(token, done=False):
+            payload = {'model': model_name, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done}
+            if chat:
+                payload['message'] = {'role': 'assistant', 'content': token}
+            else:
+                payload['response'] = token
+            return payload
+
+        # A request without a prompt or messages only loads the model, as the client's warmup does
+        if not prompt and not request.get('messages'):
+            self._send_json(dict(
+                chunk(''), done=True, done_reason='load', load_duration=int(load_duration * 1e9),
+                total_duration=int((time.perf_counter() - start) * 1e9)
+            ))
+            return
+        prompt_tokens = len(prompt.split())
+        time.sleep(prompt_tokens / mock.prompt_tokens_per_second)
+        prompt_eval_end = time.perf_counter()
+        tokens = [f'token{i} ' for i in range(max(1, round(mock.sample(mock.response_tokens))))]
+        token_interval = 1 / mock.tokens_per_second_for(model_name)
+
+        def final_chunk(eval_start):
+            end = time.perf_counter()
+            return dict(
+                chunk('', done=True),
+                done_reason='stop',
+                total_duration=int((end - start) * 1e9),
+                load_duration=int(load_duration * 1e9),
+                prompt_eval_count=prompt_tokens,
+                prompt_eval_duration=int((prompt_eval_end - start - load_duration) * 1e9),
+                eval_count=len(tokens),
+                eval_duration=int((end - eval_start) * 1e9)
+            )
+
+        if request.get('stream', True):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            # An injected disconnect drops the connection halfway through the answer
+            disconnect_at = len(tokens) // 2 if mock.chance(mock.disconnect_rate) else None
+            eval_start = time.perf_counter()
+            for i, token in enumerate(tokens):
+                if i == disconnect_at:
+                    mock.count('disconnect')
+                    self.close_connection = True
+                    return
+                time.sleep(token_interval)
+                self._send_chunk(chunk(token))
+            self._send_chunk(final_chunk(eval_start))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            eval_start = time.perf_counter()
+            time.sleep(len(tokens) * token_interval)
+            result = final_chunk(eval_start)
+            if chat:
+                result['message']['content'] = ''.join(tokens)
+            else:
+                result['response'] = ''.join(tokens)
+            self._send_json(result)
+
+    def _embed(self, request, model_name):
+        mock = self.server.mock
+        start = time.perf_counter()
+        load_duration = mock.load(model_name, request.get('keep_alive'))
+        if self.path == '/api/embeddings':
+            self._send_json({'embedding': mock.embedding(request.get('prompt', ''))})
+            return
+        texts = request.get('input', '')
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self._send_json({
+            'model': model_name,
+            'embeddings': [mock.embedding(text) for text in texts],
+            'total_duration': int((time.perf_counter() - start) * 1e9),
+            'load_duration': int(load_duration * 1e9),
+            'prompt_eval_count': sum(len(text.split()) for text in texts)
+        })
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Listen backlog, the default of 5 refuses connections under load
+
+    def handle_error(self, request, client_address):
+        # Clients closing kept-alive connections are routine, not errors
+        pass
+
+class MockOllamaServer:
+    def __init__(self, host='127.0.0.1', port=0, models=('mock-small', 'mock-large'), tokens_per_second=200,
+                 prompt_tokens_per_second=2000, response_tokens=32, load_time=0.2, latency=None, error_rate=0.0,
+                 error_status=500, disconnect_rate=0.0, embedding_models=('mock-embed',), embedding_dim=64,
+                 legacy_embeddings=False, keep_alive=300, model_sizes=None, seed=None):
+        self.models = list(models)
+        self.tokens_per_second = tokens_per_second  # Generation speed, or a dict of speeds by model name
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        # Answer length, load time and the latency added to every generation or embedding request are
+        # numbers of tokens or seconds, or distributions as taken by parse_distribution
+        self.response_tokens = parse_distribution(response_tokens)
+        self.load_time = parse_distribution(load_time)  # Cold start delay paid by the request that loads a model
+        self.latency = parse_distribution(latency)
+        self.error_rate = error_rate  # Share of requests answered with error_status
+        self.error_status = error_status
+        self.disconnect_rate = disconnect_rate  # Share of streamed answers cut off halfway
+        self.embedding_models = list(embedding_models)
+        self.embedding_dim = embedding_dim
+        self.legacy_embeddings = legacy_embeddings  # Only serve /api/embeddings, like servers before /api/embed
+        self.keep_alive = keep_alive  # Default seconds a model stays loaded after a request
+        self.model_sizes = model_sizes or {}  # Bytes reported by /api/tags and /api/ps, 1 GiB when missing
+        self.requests = {}  # Requests served by path, plus injected 'error' and 'disconnect' counts
+        self._random = random.Random(seed)
+        self._loaded = {}  # model name -> time.time() it unloads, None for never
+        self._load_locks = {}
+        self._word_vectors = {}
+        self._lock = threading.Lock()
+        self.httpd = MockHTTPServer((host, port), MockOllamaHandler)
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def sample(self, distribution):
+        if distribution is None:
+            return 0.0
+        with self._lock:
+            return distribution(self._random)
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def tokens_per_second_for(self, model_name):
+        if isinstance(self.tokens_per_second, dict):
+            return self.tokens_per_second.get(model_name, 200)
+        return self.tokens_per_second
+
+    def model_size(self, model_name):
+        return self.model_sizes.get(model_name, 1 << 30)
+
+    def describe(self, model_name):
+        family = 'bert' if model_name in self.embedding_models else 'mock'
+        return {
+            'name': model_name, 'model': model_name, 'size': self.model_size(model_name),
+            'digest': hashlib.sha256(model_name.encode()).hexdigest(),
+            'details': {'family': family, 'quantization_level': 'F16'}
+        }
+
+    def loaded_models(self):
+        # (name, expires_at) of the models in memory, expires_at in Ollama's RFC 3339 format
+        now = time.time()
+        with self._lock:
+            loaded = [(name, expires) for name, expires in self._loaded.items() if expires is None or expires > now]
+        return [
+            (name, datetime.fromtimestamp(expires if expires is not None else now + 10 * 365 * 86400,
+                                          timezone.utc).isoformat())
+            for name, expires in loaded
+        ]
+
+    def load(self, model_name, keep_alive=None):
+        # Returns the load time charged to this request. Requests arriving during a load wait for it,
+        # as Ollama does, and the model stays loaded for keep_alive seconds after the request.
+        with self._lock:
+            lock = self._load_locks.setdefault(model_name, threading.Lock())
+        with lock:
+            expires = self._loaded.get(model_name, 0)
+            load_time = 0.0
+            if expires is not None and expires <= time.time():
+                load_time = self.sample(self.load_time)
+                time.sleep(load_time)
+            seconds = parse_keep_alive(keep_alive, self.keep_alive)
+            with self._lock:
+                self._loaded[model_name] = None if seconds < 0 else time.time() + seconds
+        return load_time
+
+    def embedding(self, text):
+        # Bag of words embedding: the sum of a fixed random vector per word, normalised. Texts sharing
+        # words get similar vectors, which is enough to test semantic search end to end.
+        vector = [0.0] * self.embedding_dim
+        for word in re.findall(r'\w+', text.lower()):
+            word_vector = self._word_vectors.get(word)
+            if word_vector is None:
+                rng = random.Random(hashlib.sha256(word.encode('utf-8')).digest())
+                word_vector = self._word_vectors[word] = [rng.gauss(0, 1) for _ in range(self.embedding_dim)]
+            vector = [a + b for a, b in zip(vector, word_vector)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
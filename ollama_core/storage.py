@@ -0,0 +1,481 @@
+import json
+import time
+import queue
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+from .metrics import LATENCY_METRICS
+from .telemetry import DB_COMMIT_DURATION, DB_ERRORS, DB_TRANSACTION_DURATION, span
+
+# Columns added to conversations after the original schema, created on startup when missing
+METRIC_COLUMNS = {
+    'response_time': 'REAL',
+    'ttft': 'REAL',
+    'prompt_eval_count': 'INTEGER',
+    'eval_count': 'INTEGER',
+    'total_duration': 'REAL',
+    'load_duration': 'REAL',
+    'prompt_eval_duration': 'REAL',
+    'eval_duration': 'REAL',
+    'options': 'TEXT',  # Generation options as JSON
+    'content_hash': 'BLOB'  # Filled in by the importer to skip turns that are already stored
+}
+
+# Secondary indexes on conversations: per-session history paging, per-model stats and import dedup
+CONVERSATION_INDEXES = {
+    'idx_conversations_session_timestamp': 'session_id, timestamp',
+    'idx_conversations_model_timestamp': 'model_name, timestamp',
+    'idx_conversations_content_hash': 'content_hash'
+}
+
+# Triggers keeping the FTS5 index in sync with the conversations table
+SEARCH_TRIGGERS = {
+    'conversations_fts_insert': '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts (rowid, user_input, bot_response)
+            VALUES (new.id, new.user_input, new.bot_response);
+        END
+    ''',
+    'conversations_fts_delete': '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, user_input, bot_response)
+            VALUES ('delete', old.id, old.user_input, old.bot_response);
+        END
+    ''',
+    'conversations_fts_update': '''
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_update
+        AFTER UPDATE OF user_input, bot_response ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, user_input, bot_response)
+            VALUES ('delete', old.id, old.user_input, old.bot_response);
+            INSERT INTO conversations_fts (rowid, user_input, bot_response)
+            VALUES (new.id, new.user_input, new.bot_response);
+        END
+    '''
+}
+
+# Identity of a turn for deduplication, independent of the session and row id it was stored under
+def content_hash(model_name, timestamp, user_input, bot_response):
+    content = f"{model_name or ''}\x1f{timestamp or ''}\x1f{user_input or ''}\x1f{bot_response or ''}"
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+# Database manager class for managing database operations
+class DatabaseManager:
+    def __init__(self, db_name='chat_history.db', pool_size=5, busy_timeout=30):
+        self.db_name = db_name
+        self.busy_timeout = busy_timeout  # Seconds to wait on a locked database before failing
+        # Pool of long-lived connections shared by all threads instead of a connect/close per call
+        self._pool = queue.Queue(maxsize=pool_size)
+        self.initialize_database()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.busy_timeout, check_same_thread=False)
+        # Lets PRAGMA incremental_vacuum return deleted pages to the file system a few at a time. Only takes
+        # effect on a new database before journal_mode writes its header, existing ones switch on a full VACUUM.
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        # WAL lets readers run alongside a writer, NORMAL only fsyncs at checkpoints in WAL mode
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # SQLite leaves foreign keys unenforced unless enabled per connection, which ON DELETE CASCADE needs
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    @contextmanager
+    def connection(self, operation='other'):
+        # Borrow a pooled connection, commit on success and roll back on error. The time the
+        # connection is held and the commit time are recorded under `operation`.
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        start_time = time.perf_counter()
+        try:
+            with span('db.' + operation):
+                try:
+                    yield conn
+                except BaseException:
+                    conn.rollback()
+                    DB_ERRORS.inc(operation=operation)
+                    raise
+                commit_start = time.perf_counter()
+                conn.commit()
+                DB_COMMIT_DURATION.observe(time.perf_counter() - commit_start, operation=operation)
+        finally:
+            DB_TRANSACTION_DURATION.observe(time.perf_counter() - start_time, operation=operation)
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def initialize_database(self):
+        with self.connection('initialize') as conn:
+            c = conn.cursor()
+            # Create the session table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS session (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Create the conversations table with response_time column
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id INTEGER,
+                    model_name TEXT,
+                    user_input TEXT,
+                    bot_response TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES session(id) ON DELETE CASCADE
+                )
+            ''')
+            # Add timing and token count columns missing from older databases
+            c.execute("PRAGMA table_info(conversations)")
+            columns = [column[1] for column in c.fetchall()]
+            for column, column_type in METRIC_COLUMNS.items():
+                if column not in columns:
+                    c.execute(f'ALTER TABLE conversations ADD COLUMN {column} {column_type}')
+            if not any(row[6] == 'CASCADE' for row in c.execute('PRAGMA foreign_key_list(conversations)')):
+                self._migrate_cascade(conn)
+            # Indexes for history paging, stats, import dedup and the session list ordering
+            self.create_indexes(conn)
+            c.execute('CREATE INDEX IF NOT EXISTS idx_session_timestamp ON session (timestamp)')
+        self.fts_enabled = self.initialize_search_index()
+
+    @classmethod
+    def _migrate_cascade(cls, conn):
+        # SQLite can't alter a foreign key, so databases created before ON DELETE CASCADE get their
+        # conversations table rebuilt once with the same rows, ids, indexes and triggers
+        conn.commit()
+        # Must be off while the old table is dropped, and can only change outside a transaction
+        conn.execute('PRAGMA foreign_keys=OFF')
+        try:
+            conn.execute('BEGIN')
+            columns = [
+                f"{name} {column_type}" + (f' DEFAULT {default}' if default is not None else '')
+                for _, name, column_type, _, default, _ in conn.execute('PRAGMA table_info(conversations)')
+                if name != 'id'
+            ]
+            triggers = [row[0] for row in conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'conversations'"
+            )]
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'conversations'").fetchone()
+            conn.execute(f'''
+                CREATE TABLE conversations_migrated (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    {', '.join(columns)},
+                    FOREIGN KEY (session_id) REFERENCES session(id) ON DELETE CASCADE
+                )
+            ''')
+            names = ', '.join(['id'] + [column.split()[0] for column in columns])
+            conn.execute(f'INSERT INTO conversations_migrated ({names}) SELECT {names} FROM conversations')
+            conn.execute('DROP TABLE conversations')
+            conn.execute('ALTER TABLE conversations_migrated RENAME TO conversations')
+            if sequence:
+                # Ids of deleted rows are never reused, as before the rebuild
+                conn.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'conversations'", (sequence[0],)
+                )
+            cls.create_indexes(conn)
+            for trigger in triggers:
+                conn.execute(trigger)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute('PRAGMA foreign_keys=ON')
+
+    def initialize_search_index(self):
+        # FTS5 index over the conversation text, kept in sync with the conversations table by triggers
+        try:
+            with self.connection('initialize') as conn:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+                ).fetchone()
+                conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+                        user_input, bot_response, content='conversations', content_rowid='id'
+                    )
+                ''')
+                for trigger in SEARCH_TRIGGERS.values():
+                    conn.execute(trigger)
+                # Backfill rows saved before the index existed
+                if not exists:
+                    conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            # SQLite was built without FTS5, search falls back to LIKE matching
+            return False
+        return True
+
+    @staticmethod
+    def create_indexes(conn, names=None):
+        for name in names or CONVERSATION_INDEXES:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON conversations ({CONVERSATION_INDEXES[name]})')
+
+    def rebuild_search_index(self):
+        with self.connection('rebuild_search_index') as conn:
+            conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+            conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('optimize')")
+
+    @staticmethod
+    def _conversation_values(session_id, model_name, user_input, bot_response, response_time,
+                             ttft=None, metrics=None, options=None):
+        metrics = metrics or {}
+        return (
+            session_id, model_name, user_input, bot_response, response_time, ttft,
+            metrics.get('prompt_eval_count'), metrics.get('eval_count'), metrics.get('total_duration'),
+            metrics.get('load_duration'), metrics.get('prompt_eval_duration'), metrics.get('eval_duration'),
+            json.dumps(options, sort_keys=True) if options else None
+        )
+
+    def save_conversation(self, session_id, model_name, user_input, bot_response, response_time,
+                          ttft=None, metrics=None, options=None):
+        self.save_conversation_rows([
+            (session_id, model_name, user_input, bot_response, response_time, ttft, metrics, options)
+        ])
+
+    def save_conversations(self, session_id, user_input, responses, options=None):
+        # Save several (model_name, bot_response, response_time, ttft, metrics) results in a single transaction
+        self.save_conversation_rows([
+            (session_id, model_name, user_input, bot_response, response_time, ttft, metrics, options)
+            for model_name, bot_response, response_time, ttft, metrics in responses
+        ])
+
+    def save_conversation_rows(self, rows):
+        # Insert (session_id, model_name, user_input, bot_response, response_time[, ttft, metrics, options])
+        # rows in one transaction, metrics being the dict returned by extract_metrics
+        if not rows:
+            return
+        with self.connection('save_conversations') as conn:
+            self.insert_conversations(conn, rows)
+
+    @classmethod
+    def insert_conversations(cls, conn, rows):
+        # save_conversation_rows on a connection the caller holds, to save as part of a larger transaction
+        conn.executemany('''
+            INSERT INTO conversations (
+                session_id, model_name, user_input, bot_response, response_time, ttft,
+                prompt_eval_count, eval_count, total_duration, load_duration,
+                prompt_eval_duration, eval_duration, options
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [cls._conversation_values(*row) for row in rows])
+
+    def create_new_session(self, name):
+        try:
+            with self.connection('create_session') as conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT INTO session (name)
+                    VALUES (?)
+                ''', (name,))
+                session_id = c.lastrowid
+        except sqlite3.IntegrityError:
+            session_id = None  # Session name already exists
+        return session_id
+
+    def get_or_create_session(self, name):
+        with self.connection('create_session') as conn:
+            conn.execute('INSERT OR IGNORE INTO session (name) VALUES (?)', (name,))
+            return conn.execute('SELECT id FROM session WHERE name = ?', (name,)).fetchone()[0]
+
+    def load_sessions(self):
+        with self.connection('load_sessions') as conn:
+            return conn.execute('SELECT id, name FROM session ORDER BY timestamp DESC').fetchall()
+
+    def find_session(self, name):
+        with self.connection('load_sessions') as conn:
+            row = conn.execute('SELECT id FROM session WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def load_conversation_history(self, session_id):
+        with self.connection('load_history') as conn:
+            return conn.execute('''
+                SELECT user_input, bot_response, model_name, timestamp, response_time
+                FROM conversations
+                WHERE session_id = ?
+                ORDER BY timestamp DESC, id DESC
+            ''', (session_id,)).fetchall()
+
+    def count_conversations(self, session_id):
+        # Counted from the (session_id, timestamp) index, cheap enough to run on every rerun
+        with self.connection('load_history') as conn:
+            return conn.execute('SELECT COUNT(*) FROM conversations WHERE session_id = ?', (session_id,)).fetchone()[0]
+
+    def load_recent_turns(self, session_id, model_name, limit, after=0):
+        # Newest first (id, user_input, bot_response) rows of one model in a session, only those with an id
+        # above `after` when given
+        with self.connection('load_history') as conn:
+            return conn.execute('''
+                SELECT id, user_input, bot_response
+                FROM conversations
+                WHERE session_id = ? AND model_name = ? AND id > ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (session_id, model_name, after, limit)).fetchall()
+
+    def load_conversation_page(self, session_id, limit=50, before=None, search='', after=None):
+        # Keyset pagination, newest first. `before` is the (timestamp, id) cursor returned with the
+        # previous page, so every page is an index range scan instead of an OFFSET over older rows.
+        # `after` only returns rows newer than a (timestamp, id) cursor, limit=None returns them all.
+        query = '''
+            SELECT id, user_input, bot_response, model_name, timestamp, response_time, load_duration
+            FROM conversations
+            WHERE session_id = ?
+        '''
+        params = [session_id]
+        if before:
+            query += ' AND timestamp <= ? AND (timestamp < ? OR id < ?)'
+            params += [before[0], before[0], before[1]]
+        if after:
+            query += ' AND timestamp >= ? AND (timestamp > ? OR id > ?)'
+            params += [after[0], after[0], after[1]]
+        if search:
+            query += " AND (user_input LIKE ? ESCAPE '\\' OR bot_response LIKE ? ESCAPE '\\')"
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params += [pattern, pattern]
+        query += ' ORDER BY timestamp DESC, id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self.connection('load_history') as conn:
+            rows = conn.execute(query, params).fetchall()
+        next_cursor = (rows[-1][4], rows[-1][0]) if limit is not None and len(rows) == limit else None
+        return rows, next_cursor
+
+    def iter_conversations(self, columns, session_id=None, model_name=None, since=None, before=None,
+                           chunk_size=1000):
+        # Yields lists of at most chunk_size rows with the given conversations columns plus session_name,
+        # oldest first, read from a single cursor so memory stays constant however large the history is.
+        # `since` is inclusive and `before` exclusive, both compared with the stored timestamp text.
+        sql = f'''
+            SELECT {', '.join('c.' + column for column in columns)}, s.name
+            FROM conversations c
+            LEFT JOIN session s ON s.id = c.session_id
+            WHERE 1 = 1
+        '''
+        params = []
+        if session_id is not None:
+            sql += ' AND c.session_id = ?'
+            params.append(session_id)
+        if model_name:
+            sql += ' AND c.model_name = ?'
+            params.append(model_name)
+        if since:
+            sql += ' AND c.timestamp >= ?'
+            params.append(since)
+        if before:
+            sql += ' AND c.timestamp < ?'
+            params.append(before)
+        sql += ' ORDER BY c.id'
+        with self.connection('export') as conn:
+            cursor = conn.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+
+    def delete_session(self, session_id):
+        # Conversations go with the session through ON DELETE CASCADE, and their search index entries,
+        # embeddings and jobs through triggers
+        with self.connection('delete_session') as conn:
+            conn.execute('DELETE FROM session WHERE id = ?', (session_id,))
+
+    def throughput_by_day(self, model_name=None, days=30):
+        # (day, model_name, requests, tokens_per_second, avg_response_time) rows, newest day first.
+        # Tokens/sec is total generated tokens over total generation time, so long answers weigh more.
+        sql = '''
+            SELECT date(timestamp) AS day, model_name, COUNT(*),
+                   SUM(eval_count) / NULLIF(SUM(CASE WHEN eval_count IS NOT NULL THEN eval_duration END), 0),
+                   AVG(response_time)
+            FROM conversations
+            WHERE timestamp >= datetime('now', ?)
+        '''
+        params = [f'-{int(days)} days']
+        if model_name:
+            sql += ' AND model_name = ?'
+            params.append(model_name)
+        sql += ' GROUP BY day, model_name ORDER BY day DESC, model_name'
+        with self.connection('stats') as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def latency_percentiles(self, metric='response_time', model_name=None, days=30):
+        # (model_name, count, p50, p95, p99) rows using nearest-rank percentiles computed in SQL
+        if metric not in LATENCY_METRICS:
+            raise ValueError(f'Unsupported latency metric: {metric}')
+        model_filter = 'AND model_name = ?' if model_name else ''
+        sql = f'''
+            WITH ranked AS (
+                SELECT model_name, {metric} AS value,
+                       ROW_NUMBER() OVER (PARTITION BY model_name ORDER BY {metric}) AS rank,
+                       COUNT(*) OVER (PARTITION BY model_name) AS total
+                FROM conversations
+                WHERE {metric} IS NOT NULL AND timestamp >= datetime('now', ?) {model_filter}
+            )
+            SELECT model_name, MAX(total),
+                   MIN(CASE WHEN rank >= 0.50 * total THEN value END),
+                   MIN(CASE WHEN rank >= 0.95 * total THEN value END),
+                   MIN(CASE WHEN rank >= 0.99 * total THEN value END)
+            FROM ranked
+            GROUP BY model_name
+            ORDER BY model_name
+        '''
+        params = [f'-{int(days)} days'] + ([model_name] if model_name else [])
+        with self.connection('stats') as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def search(self, query, session_id=None, limit=20):
+        # Ranked full-text search over one session or all of them. Returns
+        # (id, session_id, model_name, timestamp, user_snippet, bot_snippet) rows, best match first.
+        terms = query.split()
+        if not terms:
+            return []
+        if not self.fts_enabled:
+            return self._search_like(query, session_id, limit)
+        # Quote every term so user input can't inject FTS syntax, and prefix-match the last one
+        match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms) + '*'
+        sql = '''
+            SELECT c.id, c.session_id, c.model_name, c.timestamp,
+                   snippet(conversations_fts, 0, '<mark>', '</mark>', '…', 16),
+                   snippet(conversations_fts, 1, '<mark>', '</mark>', '…', 32)
+            FROM conversations_fts
+            JOIN conversations c ON c.id = conversations_fts.rowid
+            WHERE conversations_fts MATCH ?
+        '''
+        params = [match]
+        if session_id is not None:
+            sql += ' AND c.session_id = ?'
+            params.append(session_id)
+        sql += ' ORDER BY bm25(conversations_fts) LIMIT ?'
+        params.append(limit)
+        with self.connection('search') as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _search_like(self, query, session_id, limit):
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = '''
+            SELECT id, session_id, model_name, timestamp, user_input, bot_response
+            FROM conversations
+            WHERE (user_input LIKE ? ESCAPE '\\' OR bot_response LIKE ? ESCAPE '\\')
+        '''
+        params = [pattern, pattern]
+        if session_id is not None:
+            sql += ' AND session_id = ?'
+            params.append(session_id)
+        sql += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        params.append(limit)
+        with self.connection('search') as conn:
+            return conn.execute(sql, params).fetchall()
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Bucket upper bounds in seconds for Ollama requests, which range from milliseconds to minutes
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Bucket upper bounds in seconds for SQLite transactions
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+# Base of the metric types: a family of series keyed by label values, e.g. one per (model, host)
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        values = (labels.get(name) for name in self.labels)
+        return tuple('' if value is None else str(value) for value in values)
+
+    def samples(self):
+        # (suffix, label_values, extra_labels, value) tuples for the text format
+        with self._lock:
+            return [('', key, (), value) for key, value in self._series.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts with a final +Inf bucket, then the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), series[-1]))
+                samples.append(('_count', key, (), cumulative))
+        return samples
+
+# Set of metrics rendered together in the Prometheus text exposition format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            # Declaring the same metric twice returns the first, e.g. when a module is reloaded
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collect(self):
+        # Snapshot as {name: [(suffix, labels dict, value), ...]} for exporters other than /metrics
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: [
+                (suffix, dict(zip(metric.labels, key), **dict(extra)), value)
+                for suffix, key, extra, value in metric.samples()
+            ]
+            for metric in metrics
+        }
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+    def clear(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+REGISTRY = MetricsRegistry()
+
+# Metrics recorded by the client, the response cache and the database layer
+REQUESTS = REGISTRY.counter(
+    'ollama_requests_total', 'Requests sent to Ollama by status code', ('model', 'host', 'endpoint', 'status')
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    'ollama_request_duration_seconds', 'Ollama request latency, to the last streamed chunk for streams',
+    ('model', 'host', 'endpoint')
+)
+REQUEST_ERRORS = REGISTRY.counter(
+    'ollama_request_errors_total', 'Failed Ollama requests by kind (connection, timeout, request, http_5xx, api)',
+    ('model', 'host', 'kind')
+)
+RETRIES = REGISTRY.counter('ollama_request_retries_total', 'Requests retried or failed over to another host', ('host',))
+IN_FLIGHT = REGISTRY.gauge('ollama_requests_in_flight', 'Ollama requests currently in flight', ('host',))
+TTFT = REGISTRY.histogram('ollama_ttft_seconds', 'Time to first streamed token', ('model',))
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    'ollama_tokens_per_second', "Generation speed from Ollama's eval_count and eval_duration", ('model',),
+    TOKEN_RATE_BUCKETS
+)
+CACHE_REQUESTS = REGISTRY.counter('ollama_cache_requests_total', 'Response cache lookups', ('result',))
+DB_TRANSACTION_DURATION = REGISTRY.histogram(
+    'ollama_db_transaction_seconds', 'Time a database connection is held, queries and commit included',
+    ('operation',), DB_BUCKETS
+)
+DB_COMMIT_DURATION = REGISTRY.histogram(
+    'ollama_db_commit_seconds', 'Time spent committing database transactions', ('operation',), DB_BUCKETS
+)
+DB_ERRORS = REGISTRY.counter('ollama_db_errors_total', 'Database transactions rolled back on an error', ('operation',))
+DB_MAINTENANCE = REGISTRY.counter(
+    'ollama_db_maintenance_total', 'Rows and pages removed by database maintenance, by kind', ('kind',)
+)
+JOBS = REGISTRY.counter('ollama_jobs_total', 'Background generation jobs finished, by status', ('status',))
+JOB_QUEUE_WAIT = REGISTRY.histogram('ollama_job_queue_wait_seconds', 'Time jobs wait in the queue before a worker starts them')
+
+def start_http_server(port, addr='127.0.0.1', registry=REGISTRY):
+    # Serves the registry at /metrics for Prometheus from a daemon thread and returns the server,
+    # port 0 picks a free one. Only local clients can connect unless addr says otherwise, e.g. '0.0.0.0',
+    # since the metrics name models and hosts. http.server is imported here to keep it out of startup.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+_env_configured = False
+
+def configure_from_env():
+    # Starts the /metrics endpoint on $OLLAMA_METRICS_PORT (bound to $OLLAMA_METRICS_ADDR, localhost by
+    # default) and writes spans to $OLLAMA_TRACE_FILE when they are set. Only the first call does
+    # anything, so front-ends can call it on every run.
+    global _env_configured
+    if _env_configured:
+        return
+    _env_configured = True
+    if os.environ.get('OLLAMA_METRICS_PORT'):
+        start_http_server(
+            int(os.environ['OLLAMA_METRICS_PORT']), os.environ.get('OLLAMA_METRICS_ADDR') or '127.0.0.1'
+        )
+    if os.environ.get('OLLAMA_TRACE_FILE'):
+        add_span_exporter(JsonlSpanExporter(os.environ['OLLAMA_TRACE_FILE']))
+
+# Lightweight OpenTelemetry-style tracing. A span records a named stage with its duration,
+# attributes and parent. Finished spans go to the registered exporters as dicts, and nothing is
+# recorded while no exporter is registered.
+_exporters = []
+_current_span = contextvars.ContextVar('ollama_core_span', default=None)
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        record = {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration': self.duration,
+            'status': 'error' if error else 'ok',
+            'attributes': self.attributes
+        }
+        if error:
+            record['error'] = str(error)
+        for exporter in list(_exporters):
+            exporter(record)
+
+# Stand-in returned while tracing is off so instrumented code doesn't need to check
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def add_span_exporter(exporter):
+    # exporter(record) is called with each finished span, from the thread that ended it
+    _exporters.append(exporter)
+
+def remove_span_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+def start_span(name, **attributes):
+    # A span that is ended explicitly and never becomes the current one, for work that outlives a
+    # with block, e.g. a streamed response consumed by a generator
+    if not _exporters:
+        return NOOP_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+@contextmanager
+def use_span(span):
+    # Makes span the parent of spans started inside the block
+    if span is NOOP_SPAN:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+@contextmanager
+def span(name, **attributes):
+    current = start_span(name, **attributes)
+    with use_span(current):
+        try:
+            yield current
+        except BaseException as e:
+            current.end(error=repr(e))
+            raise
+    current.end()
+
+# Span exporter appending one JSON object per span to a file
+class JsonlSpanExporter:
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -1,119 +1,37 @@
 import gradio as gr
-import sqlite3
-import subprocess
-import requests
-import json
-from datetime import datetime
-
-# Initialize database and create tables if they don't exist
-def initialize_database():
-    conn = sqlite3.connect('chat_history.db')
-    c = conn.cursor()
-    # Create the session table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS session (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # Create the conversations table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER,
-            model_name TEXT,
-            user_input TEXT,
-            bot_response TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES session(id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Function to get a list of available models from the command line
-def get_available_models():
-    try:
-        result = subprocess.run(['ollama', 'list'], capture_output=True, text=True, check=True)
-        lines = result.stdout.strip().split('\n')
-        models = [line.split()[0] for line in lines[1:]]  # Skip the header line and get the model name
-        return models
-    except subprocess.CalledProcessError as e:
-        print(f"Error retrieving model list: {e}")
-        return []
-
-# Function to generate a response from the selected model
-def generate_response(model_name, user_input):
-    url = f'http://localhost:11434/api/generate'
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        'model': model_name,
-        'prompt': user_input,
-        'stream': False
-    }
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    if response.status_code == 200:
-        return response.json().get('response', '')
-    else:
-        print('Error communicating with the model.')
-        return ''
-
-# Function to save conversation to the database
-def save_conversation(session_id, model_name, user_input, bot_response):
-    conn = sqlite3.connect('chat_history.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO conversations (session_id, model_name, user_input, bot_response)
-        VALUES (?, ?, ?, ?)
-    ''', (session_id, model_name, user_input, bot_response))
-    conn.commit()
-    conn.close()
-
-# Function to create a new session and return its ID
-def create_new_session(name):
-    conn = sqlite3.connect('chat_history.db')
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO session (name)
-        VALUES (?)
-    ''', (name,))
-    conn.commit()
-    session_id = c.lastrowid
-    conn.close()
-    return session_id
-
-# Function to load all sessions
-def load_sessions():
-    conn = sqlite3.connect('chat_history.db')
-    c = conn.cursor()
-    c.execute('SELECT id, name FROM session ORDER BY timestamp DESC')
-    sessions = c.fetchall()
-    conn.close()
-    return sessions
-
-# Function to load conversation history by session ID
-def load_conversation_history(session_id):
-    conn = sqlite3.connect('chat_history.db')
-    c = conn.cursor()
-    c.execute('''
-        SELECT user_input, bot_response, model_name
-        FROM conversations
-        WHERE session_id = ?
-        ORDER BY timestamp DESC
-    ''', (session_id,))
-    conversation = c.fetchall()
-    conn.close()
-    return conversation
-
-# Initialize the database
-initialize_database()
+import os
+import sys
+import time
+
+from ollama_core import ChatContextManager, DatabaseMaintenance, DatabaseManager, JobQueue, OllamaAPIClient
+from ollama_core.jobs import ACTIVE_STATUSES
+from ollama_core.telemetry import configure_from_env
+
+# /metrics on $OLLAMA_METRICS_PORT and spans to $OLLAMA_TRACE_FILE when they are set
+configure_from_env()
+
+# Storage, Ollama client and chat context shared with the Streamlit app, so both use the same schema,
+# migrations and connection pooling. OLLAMA_HOSTS may list several comma separated Ollama hosts.
+ollama_client = OllamaAPIClient(base_url=os.environ.get('OLLAMA_HOSTS', 'http://localhost:11434'))
+ollama_client.registry.prefetch()  # Fetch the model list while the database is opened
+db_manager = DatabaseManager()
+chat_context = ChatContextManager(db_manager)
+
+# Replies are generated by jobs queued in the database, so they are saved even when the browser disconnects.
+# The chat context reads the saved turns back by itself, whichever process ran the job.
+job_queue = JobQueue(db_manager, ollama_client)
+job_queue.start()
+JOB_POLL_INTERVAL = 0.2  # Seconds between reads of the partial reply
+
+# Retention, orphan cleanup and incremental vacuum in a background thread, configured like the Streamlit app
+# through OLLAMA_RETENTION_DAYS, OLLAMA_MAX_DB_MB and OLLAMA_ARCHIVE_PATH
+DatabaseMaintenance(db_manager).start()
 
 # Load initial data
-models = get_available_models()
+models = ollama_client.get_available_models()
 if not models:
     models = ["No models found. Please check your Ollama installation."]
-session_list = load_sessions()
+session_list = db_manager.load_sessions()
 session_names = [name for id, name in session_list]
 
 # Define Gradio app
@@ -124,6 +42,7 @@ with gr.Blocks() as demo:
         with gr.Column(scale=1):
             gr.Markdown('## Select Model')
             model_dropdown = gr.Dropdown(label='Model', choices=models, value=models[0] if models else None)
+            conversation_mode = gr.Checkbox(label='Remember conversation')
 
             gr.Markdown('## Create New Session')
             session_name_input = gr.Textbox(label='Enter new session name')
@@ -138,6 +57,11 @@ with gr.Blocks() as demo:
             user_input = gr.Textbox(label='You:', lines=2)
             send_button = gr.Button('Send')
 
+            gr.Markdown('## Search Conversation History')
+            search_input = gr.Textbox(label='Search')
+            search_all_sessions = gr.Checkbox(label='Search all sessions')
+            search_results = gr.Markdown()
+
     # Initialize states
     session_list_state = gr.State(value=session_list)
     conversation_history_state = gr.State(value=[])
@@ -146,8 +70,10 @@ with gr.Blocks() as demo:
 
     # Function to add a new session
     def add_new_session(session_name, session_list_state):
+        session_id = db_manager.create_new_session(session_name) if session_name else None
+        if session_name and session_id is None:
+            raise gr.Error('Session name already exists. Please choose a different name.')
         if session_name:
-            session_id = create_new_session(session_name)
             # Update session_list_state
             session_list_state.append((session_id, session_name))
             # Update session names
@@ -184,9 +110,9 @@ with gr.Blocks() as demo:
                 session_id = id
                 break
         if session_id:
-            conversation = load_conversation_history(session_id)
+            conversation = db_manager.load_conversation_history(session_id)
             messages = []
-            for user_msg, bot_msg, model_name in reversed(conversation):
+            for user_msg, bot_msg, model_name, *_ in reversed(conversation):
                 messages.insert(0, (user_msg, f"{model_name}: {bot_msg}"))
             # Update current session display
             current_session_name_display_value = gr.update(value=f'## Chat - {session_name}')
@@ -208,16 +134,35 @@ with gr.Blocks() as demo:
                 gr.update(value='## Chat - No Session Selected')
             )
 
-    # Function to send a message
-    def send_message(user_message, model_name, current_session_id, conversation_history_state):
+    # Function to send a message, queues a job and yields its partial reply so the Chatbot renders tokens live
+    def send_message(user_message, model_name, current_session_id, conversation_history_state, remember):
         if user_message and current_session_id:
-            bot_response = generate_response(model_name, user_message)
-            if bot_response:
-                save_conversation(current_session_id, model_name, user_message, bot_response)
-                # Append to conversation_history_state
-                conversation_history_state.append((user_message, f"{model_name}: {bot_response}"))
-                return conversation_history_state, '', conversation_history_state
-        return conversation_history_state, '', conversation_history_state
+            messages = {model_name: chat_context.build(current_session_id, model_name, user_message)} if remember else None
+            job_id = job_queue.submit(current_session_id, user_message, [model_name], messages=messages)
+            conversation_history_state.append((user_message, f"{model_name}: "))
+            while True:
+                job = job_queue.get(job_id)
+                output = job['outputs'][model_name] if job else {'output': '', 'error': None}
+                conversation_history_state[-1] = (user_message, f"{model_name}: {output['output']}")
+                yield conversation_history_state, '', conversation_history_state
+                if job is None or job['status'] not in ACTIVE_STATUSES:
+                    break
+                time.sleep(JOB_POLL_INTERVAL)
+            if output['error']:
+                print(f"Error communicating with the model: {output['error']}", file=sys.stderr)
+            if not output['output']:
+                conversation_history_state.pop()
+        yield conversation_history_state, '', conversation_history_state
+
+    # Function to search the conversation history
+    def search_history(query, search_all, current_session_id):
+        results = db_manager.search(query, None if search_all else current_session_id)
+        if not results:
+            return 'No matching messages found.' if query.strip() else ''
+        return '\n\n'.join(
+            f"**{model_name}** · {timestamp}  \nYou: {user_snippet}  \nBot: {bot_snippet}"
+            for _, _, model_name, timestamp, user_snippet, bot_snippet in results
+        )
 
     # Bind functions to events
     create_session_button.click(
@@ -248,17 +193,33 @@ with gr.Blocks() as demo:
         ]
     )
 
+    # send_message mostly sleeps between polls of its job, the job workers bound the generations, so any number
+    # of browsers may wait on their replies at once instead of queueing behind the default limit of one
     send_button.click(
         fn=send_message,
-        inputs=[user_input, model_dropdown, current_session_id, conversation_history_state],
-        outputs=[chat_display, user_input, conversation_history_state]
+        inputs=[user_input, model_dropdown, current_session_id, conversation_history_state, conversation_mode],
+        outputs=[chat_display, user_input, conversation_history_state],
+        concurrency_limit=None
     )
 
     # Clear user input on enter key
     user_input.submit(
         fn=send_message,
-        inputs=[user_input, model_dropdown, current_session_id, conversation_history_state],
-        outputs=[chat_display, user_input, conversation_history_state]
+        inputs=[user_input, model_dropdown, current_session_id, conversation_history_state, conversation_mode],
+        outputs=[chat_display, user_input, conversation_history_state],
+        concurrency_limit=None
+    )
+
+    search_input.change(
+        fn=search_history,
+        inputs=[search_input, search_all_sessions, current_session_id],
+        outputs=[search_results]
+    )
+
+    search_all_sessions.change(
+        fn=search_history,
+        inputs=[search_input, search_all_sessions, current_session_id],
+        outputs=[search_results]
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import json
+import sqlite3
+
+from ollama_core.importer import HistoryImporter
+from ollama_core.storage import DatabaseManager
+
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def make_importer(tmp_path):
+    db = DatabaseManager(str(tmp_path / 'chat_history.db'))
+    db.initialize_database()
+    return db, HistoryImporter(db, default_session='Imported')
+
+
+def test_import_jsonl_skips_incomplete_records(tmp_path):
+    db, importer = make_importer(tmp_path)
+    source = tmp_path / 'mixed.jsonl'
+    write_jsonl(source, [
+        {'model_name': 'llama3', 'user_input': 'hi', 'bot_response': 'hello', 'timestamp': '2026-10-17 07:00:00'},
+        # Batch output: no model_name/user_input/bot_response columns
+        {'id': 'a1', 'prompt': 'hi', 'model': 'llama3', 'response': 'hello'},
+        {'model_name': 'llama3', 'user_input': 'hi again', 'bot_response': None},
+        {'model_name': 'llama3', 'user_input': 'when', 'bot_response': 'now', 'timestamp': 'yesterday'},
+    ])
+
+    imported, duplicates, sessions_created, invalid = importer.import_jsonl(str(source))
+
+    assert (imported, duplicates, sessions_created, invalid) == (1, 0, 1, 3)
+    with sqlite3.connect(db.db_name) as conn:
+        rows = conn.execute('SELECT model_name, user_input, bot_response FROM conversations').fetchall()
+    assert rows == [('llama3', 'hi', 'hello')]
+    db.close()
+
+
+def test_import_jsonl_normalises_timestamps_to_utc(tmp_path):
+    db, importer = make_importer(tmp_path)
+    source = tmp_path / 'iso.jsonl'
+    write_jsonl(source, [
+        {'model_name': 'llama3', 'user_input': 'a', 'bot_response': 'b', 'timestamp': '2026-10-17T07:00:00Z'},
+        {'model_name': 'llama3', 'user_input': 'c', 'bot_response': 'd', 'timestamp': '2026-10-17T09:30:15.250+02:00'},
+        # Same turn as the first record, written in SQLite's format
+        {'model_name': 'llama3', 'user_input': 'a', 'bot_response': 'b', 'timestamp': '2026-10-17 07:00:00'},
+    ])
+
+    imported, duplicates, _, invalid = importer.import_jsonl(str(source))
+
+    assert (imported, duplicates, invalid) == (2, 1, 0)
+    with sqlite3.connect(db.db_name) as conn:
+        timestamps = [row[0] for row in conn.execute('SELECT timestamp FROM conversations ORDER BY user_input')]
+    assert timestamps == ['2026-10-17 07:00:00', '2026-10-17 07:30:15']
+    db.close()